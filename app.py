@@ -1,19 +1,26 @@
 import argparse
+import atexit
+import codecs
+import hashlib
 import itertools
 import json
 import locale
 import logging
+import logging.handlers
 import os
 import pprint
 import re
 import sys
+import threading
+import tracemalloc
 import urllib.parse
+from bisect import bisect_left, bisect_right
 from collections import OrderedDict
-from datetime import datetime, timedelta
-
-import requests
-from bs4 import BeautifulSoup
-from xlwt import easyxf, Formula
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from queue import PriorityQueue, Queue
+from datetime import date, datetime, timedelta
+from html.parser import HTMLParser
 
 
 class Item(object):
@@ -50,10 +57,120 @@ class FilterByDates(object):
         return [x for x in mrs if x['foreclosure_sale_date'] in self.dates]
 
 
+class OnDates(object):
+    def __init__(self, dates):
+        self.dates = set(dates)
+
+    def keep_key(self, key):
+        return key[0] in self.dates
+
+
+class DateRange(object):
+    def __init__(self, start=None, end=None):
+        self.start = start
+        self.end = end
+
+    def keep_key(self, key):
+        return (self.start is None or key[0] >= self.start) and (self.end is None or key[0] <= self.end)
+
+
+class WithStatus(object):
+    def __init__(self, status):
+        self.status = status
+
+    def keep_key(self, key):
+        return key[1] == self.status
+
+
+class CaseType(object):
+    def __init__(self, court_type):
+        self.court_type = court_type
+
+    def keep_key(self, key):
+        return key[2] == self.court_type
+
+
+class CountWindow(object):
+    def __init__(self, low=None, high=None):
+        self.low = low
+        self.high = high
+
+    def contains(self, count):
+        return count is not None and (self.low is None or count >= self.low) and (self.high is None or count <= self.high)
+
+    def slice(self, counts):
+        lo = 0 if self.low is None else bisect_left(counts, self.low)
+        hi = len(counts) if self.high is None else bisect_right(counts, self.high)
+        return lo, hi
+
+
+class ScheduleIndex(object):
+    """The schedule bucketed by (sale date, status, court type), queried by combining predicates."""
+    ACTIVE = 'active'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, items):
+        self.items = list(items)
+        self.buckets = OrderedDict()
+        for pos, i in enumerate(self.items):
+            self.buckets.setdefault(self.get_key(i), []).append(pos)
+        self.counts = {}
+        for key, positions in self.buckets.items():
+            counts = [self.items[pos].get('count') for pos in positions]
+            ordered = None not in counts and all(a <= b for a, b in zip(counts, counts[1:]))
+            self.counts[key] = counts if ordered else None
+
+    @classmethod
+    def get_status(cls, i):
+        return cls.CANCELLED if 'CANCELLED' in i['comment'] else cls.ACTIVE
+
+    @classmethod
+    def get_key(cls, i):
+        return i['foreclosure_sale_date'], cls.get_status(i), Item.pre_cache2(i.get('case_number', ''))['court_type']
+
+    def get_positions(self, predicates):
+        key_predicates = [x for x in predicates if hasattr(x, 'keep_key')]
+        windows = [x for x in predicates if hasattr(x, 'slice')]
+        ret = []
+        for key, positions in self.buckets.items():
+            if not all(x.keep_key(key) for x in key_predicates):
+                continue
+            for window in windows:
+                if self.counts[key] is None:
+                    positions = [pos for pos in positions if window.contains(self.items[pos].get('count'))]
+                else:
+                    lo, hi = window.slice(self.counts[key])
+                    positions = positions[lo:hi]
+            ret.extend(positions)
+        return sorted(ret)
+
+    def query(self, *predicates):
+        return [self.items[pos] for pos in self.get_positions(predicates)]
+
+    def count_by_date(self, *predicates):
+        ret = {}
+        for pos in self.get_positions(predicates):
+            parsed_date = self.items[pos]['foreclosure_sale_date']
+            ret[parsed_date] = ret.get(parsed_date, 0) + 1
+        return ret
+
+    def filter(self, func):
+        return ScheduleIndex([x for x in self.items if func(x)])
+
+
 class XlBuilder(object):
-    def __init__(self, sheet_name, time_infra):
+    MISSING = '(missing)'
+    # columns filled from each enrichment source; numeric columns feeding formulas are left blank instead
+    SOURCE_COLUMNS = {'beca': ['owed_link', 'orig_mtg'],
+                      'public_records': [],
+                      'bcpao': ['address', 'zip', 'bcpao', 'f_code', 'year built'],
+                      'taxes': ['taxes'],
+                      'liens': ['lien_docs', 'lien_total']}
+
+    def __init__(self, sheet_name, time_infra, lien_columns=False):
         self.sheet_name = sheet_name
         self.time_infra = time_infra
+        self.lien_columns = lien_columns
         self.args = None
         self.column_handlers = {}
         self.headers = []
@@ -159,6 +276,8 @@ class XlBuilder(object):
                        Cell.from_display("owed - ass"),
                        Cell.from_display("orig_mtg"),
                        Cell.from_display("taxes")]
+            if self.lien_columns:
+                headers += [Cell.from_display("lien_docs"), Cell.from_display("lien_total")]
             self.headers = headers
         return self.headers
 
@@ -174,8 +293,14 @@ class XlBuilder(object):
 
     def add_to_row(self, row, r, row_index):
         i = r
+        missing_columns = set()
+        for source in i.get('missing_sources', ()):
+            missing_columns.update(self.SOURCE_COLUMNS.get(source, []))
         for col_index, h in enumerate(self.get_headers):
             str(col_index)
+            if h.get_display() in missing_columns:
+                row.append(Cell.from_display(self.MISSING))
+                continue
             if 'high' in h.get_display():
                 row.append(Cell.from_display(''))
             if 'win' in h.get_display():
@@ -203,7 +328,7 @@ class XlBuilder(object):
                         value_to_use = Cell.from_display(int(zip_str))
                 except ValueError as e:
                     value_to_use = Cell.from_display(zip_str)
-                    logging.debug(' '.join(['********exception******', str(e)]))
+                    logging.debug('********exception****** %s', e)
                 row.append(value_to_use)
             if 'owed_link' == h.get_display():
                 if 'latest_amount_due' in i and i['latest_amount_due'] and len(i['latest_amount_due']['href']) > 0:
@@ -291,6 +416,10 @@ class XlBuilder(object):
                 if 'taxes_value' in i:
                     value_to_use = Cell.from_link(i['taxes_value'], i['taxes_url'])
                 row.append(value_to_use)
+            if 'lien_docs' == h.get_display():
+                row.append(Cell.from_display(i.get('lien_docs', '')))
+            if 'lien_total' == h.get_display():
+                row.append(Cell.from_display(i.get('lien_total', '')))
 
 
 class Cell(object):
@@ -352,15 +481,62 @@ class DataSet(object):
         return self.items[row]
 
 
+_hyperlink_formula_class = None
+
+
+def get_hyperlink_formula_class():
+    # HYPERLINK formulas spliced from the RPN bytes of a parsed template, skipping xlwt's parser
+    global _hyperlink_formula_class
+    if _hyperlink_formula_class is None:
+        import struct
+        from xlwt import Formula
+        from xlwt.UnicodeUtils import upack1
+
+        def str_token(s):
+            return b'\x17' + upack1(s)  # tStr
+
+        template = Formula('HYPERLINK("u";"t")')
+        tail = template.rpn()[2 + len(str_token('u')) + len(str_token('t')):]
+
+        class HyperlinkFormula(Formula):
+            __slots__ = ['url', 'display', 'tokens']
+
+            def __init__(self, url, display):
+                self.url = url
+                self.display = display
+                self.tokens = str_token(url) + str_token(display) + tail
+
+            def get_references(self):
+                return [], []
+
+            def patch_references(self, patches):
+                pass
+
+            def text(self):
+                return 'HYPERLINK("' + self.url + '";"' + self.display + '")'
+
+            def rpn(self):
+                return struct.pack('<H', len(self.tokens)) + self.tokens
+
+        _hyperlink_formula_class = HyperlinkFormula
+    return _hyperlink_formula_class
+
+
 class Xl(object):
+    link_style = None
+
     def __init__(self):
-        self.link_style = easyxf('font: underline single, color blue')
+        # one XFStyle for the process: xlwt adds an XF record per distinct style object it sees
+        if Xl.link_style is None:
+            from xlwt import easyxf
+            Xl.link_style = easyxf('font: underline single, color blue')
 
     def add_data_set_sheet(self, ds, book):
         sheet = book.add_sheet(ds.get_name())
         self.add_data_set_sheet2(ds, sheet)
 
     def add_data_set_sheet2(self, ds, sheet):
+        widths_set = set()
         for iX, itemX in enumerate(ds.get_items()):
             row = sheet.row(iX)
             for iY, itemY in enumerate(itemX):
@@ -376,51 +552,168 @@ class Xl(object):
                         row.write(iY, itemY.get_display())
                 except:
                     raise
-                if itemY is not None and itemY.get_col_width() is not None:
+                if itemY is not None and itemY.get_col_width() is not None and iY not in widths_set:
                     sheet.col(iY).width = itemY.get_col_width()
+                    widths_set.add(iY)
 
     @staticmethod
     def get_formula_hyperlink(url, text):
-        return Formula('HYPERLINK("' + url + '";"' + text + '")')
+        try:
+            return get_hyperlink_formula_class()(url, text)
+        except Exception:
+            # e.g. strings over 255 chars; let the formula parser deal with (or reject) them as before
+            from xlwt import Formula
+            return Formula('HYPERLINK("' + url + '";"' + text + '")')
 
     @staticmethod
     def get_formula(formula):
+        from xlwt import Formula
         return Formula(formula)
 
 
+class TaxesExtractor(HTMLParser):
+    """Pulls the bill timeline out of a county-taxes page as it is fed; done once the timeline closes."""
+    UNPAID_RE = re.compile('.*\\$([\\d,.]*) due.*', re.DOTALL)
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.done = False
+        self.amount_unpaid = None
+        self.bills = []
+        self.timeline_depth = 0
+        self.current_bill = None
+        self.in_year_link = False
+        self.amount_depth = 0
+        self.amount_text = []
+        self.amount_is_unpaid = False
+
+    @staticmethod
+    def get_classes(attrs):
+        for k, v in attrs:
+            if k == 'class' and v:
+                return v.split()
+        return []
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        classes = self.get_classes(attrs)
+        if tag == 'ul' and (self.timeline_depth > 0 or 'timeline' in classes):
+            self.timeline_depth += 1
+        elif tag == 'div' and self.amount_depth > 0:
+            self.amount_depth += 1
+        elif tag == 'div' and 'amount' in classes:
+            self.amount_depth = 1
+            self.amount_text = []
+            self.amount_is_unpaid = 'unpaid' in classes
+        elif self.timeline_depth == 0:
+            return
+        elif tag == 'li':
+            self.current_bill = {'year': '', 'status': '', 'unpaid': False}
+        elif tag == 'a' and self.current_bill is not None and not self.current_bill['year']:
+            self.in_year_link = True
+
+    def handle_endtag(self, tag):
+        if self.done:
+            return
+        if tag == 'div' and self.amount_depth > 0:
+            self.amount_depth -= 1
+            if self.amount_depth == 0:
+                self.end_amount()
+        elif self.timeline_depth == 0:
+            return
+        elif tag == 'ul':
+            self.timeline_depth -= 1
+            if self.timeline_depth == 0:
+                self.done = True
+        elif tag == 'a':
+            self.in_year_link = False
+        elif tag == 'li' and self.current_bill is not None:
+            if self.current_bill['year'] and self.current_bill['status']:
+                self.bills.append(self.current_bill)
+            self.current_bill = None
+
+    def end_amount(self):
+        text = ' '.join(''.join(self.amount_text).split())
+        if self.current_bill is not None:
+            self.current_bill['status'] = text
+            self.current_bill['unpaid'] = self.amount_is_unpaid
+        if self.amount_is_unpaid and self.amount_unpaid is None:
+            m = self.UNPAID_RE.search(text)
+            if m:
+                self.amount_unpaid = m.group(1)
+
+    def handle_data(self, data):
+        if self.amount_depth > 0:
+            self.amount_text.append(data)
+        elif self.in_year_link and self.current_bill is not None:
+            self.current_bill['year'] += data.strip()
+
+    def get_certificates_sold(self):
+        return len([x for x in self.bills if 'certificate' in x['status'].lower()])
+
+
 class Taxes(object):
-    def __init__(self, taxes_infra):
+    def __init__(self, taxes_infra, tax_roll_infra=None, tax_roll_max_age=None):
         self.taxes_infra = taxes_infra
+        self.tax_roll_infra = tax_roll_infra
+        self.tax_roll_max_age = tax_roll_max_age
 
     def get_info_from_account(self, bcpao_acc):
         if len(bcpao_acc) > 0:
+            from_roll = self.get_info_from_tax_roll(bcpao_acc)
+            if from_roll is not None:
+                return from_roll
             return self.get_info_from_response(bcpao_acc, self.taxes_infra.get_resp_from_req(
                 self.get_tax_url_from_taxid(bcpao_acc)))
 
     def get_info_from_response(self, tax_id, resp):
         if resp is not None:
-            pay_all = self.get_amount_unpaid_from_tax_text(resp)
+            extracted = self.extract(resp)
+            pay_all = extracted['amount_unpaid']
             if pay_all:
                 display_str = pay_all.replace('$', '').replace(',', '')
-                ret = {'value_to_use': display_str, 'url_to_use': self.get_tax_url_from_taxid(tax_id)}
+                ret = {'value_to_use': display_str, 'url_to_use': self.get_tax_url_from_taxid(tax_id),
+                       'bills': extracted['bills'], 'certificates_sold': extracted['certificates_sold']}
                 return ret
 
+    def get_info_from_tax_roll(self, tax_id):
+        if self.tax_roll_infra is None or not self.tax_roll_infra.is_open():
+            return None
+        if self.tax_roll_max_age is not None and self.tax_roll_infra.age() > self.tax_roll_max_age:
+            return None
+        amount = self.tax_roll_infra.get_amount(tax_id)
+        if amount is None or len(amount.strip()) == 0:
+            return None
+        return {'value_to_use': amount.strip().replace('$', '').replace(',', ''),
+                'url_to_use': self.get_tax_url_from_taxid(tax_id), 'bills': [], 'certificates_sold': 0}
+
     @staticmethod
     def get_tax_url_from_taxid(tax_id):
         url = 'https://brevard.county-taxes.com/public/real_estate/parcels/' + tax_id
         return url
 
+    @staticmethod
+    def extract(r_content):
+        # r_content is the page bytes or an iterable of byte chunks
+        chunks = [r_content] if isinstance(r_content, (bytes, str)) else r_content
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        extractor = TaxesExtractor()
+        for chunk in chunks:
+            extractor.feed(chunk if isinstance(chunk, str) else decoder.decode(chunk))
+            if extractor.done:
+                break
+        if not extractor.done:
+            extractor.feed(decoder.decode(b'', final=True))
+            extractor.close()
+        return {'amount_unpaid': extractor.amount_unpaid or '0', 'bills': extractor.bills,
+                'certificates_sold': extractor.get_certificates_sold()}
+
     @staticmethod
     def get_amount_unpaid_from_tax_text(r_text):
         ret = None
         if r_text is not None:
-            ret = '0'
-            soup = BeautifulSoup(r_text.decode('utf-8'), "html.parser")
-            amt_unpaid_elem = soup.find('div', class_=re.compile('amount unpaid.*'))
-            if amt_unpaid_elem is not None:
-                m = re.search('.*\$([\d,.]*) due.*', amt_unpaid_elem.text)
-                if m:
-                    ret = m.group(1)
+            ret = Taxes.extract(r_text)['amount_unpaid']
         return ret
 
 
@@ -616,7 +909,7 @@ class Bcpao(object):
         return ret
 
     def get_acct_by_legal(self, legal_arg):
-        logging.info('getting bcpao from legal: "' + legal_arg['legal_desc'] + '"')
+        logging.info('getting bcpao from legal: "%s"', legal_arg['legal_desc'])
         bcpao_objs = self.get_bcpao_searches(legal_arg)
         for bcpao_search in bcpao_objs:
             if bcpao_search.request is not None:
@@ -689,34 +982,40 @@ class BclerkPublicRecords(object):
         resp = self.bcpr_infra.get_resp_from_request(request_info)
         return self.parse_response(resp)
 
+    @staticmethod
+    def iter_grid_rows(resp_text, columns=None):
+        # only the dgResults table is parsed, and only `columns` (all if None) are converted to text
+        from bs4 import BeautifulSoup, SoupStrainer
+        soup = BeautifulSoup(resp_text, "html.parser", parse_only=SoupStrainer('table', id='dgResults'))
+        adr = soup.find('table', id='dgResults')
+        if adr is None:
+            return
+        trs = adr.find_all("tr")
+        # first and last rows are the pager, the second one is the header
+        wanted = None
+        for a in trs[1:-1]:
+            tds = a.find_all("td")
+            if wanted is None:
+                indexes = dict((d.get_text(strip=True), c) for c, d in enumerate(tds))  # a repeated name keeps its last
+                wanted = [(name, indexes[name]) for name in (columns if columns is not None else indexes)
+                          if name in indexes]
+                continue
+            yield dict((name, tds[c].get_text(strip=True) if c < len(tds) else '') for name, c in wanted)
+
+    def get_grid_rows(self, resp_text, columns=None):
+        return list(self.iter_grid_rows(resp_text, columns))
+
     def parse_response(self, resp_text):
         rets = []
-        soup = BeautifulSoup(resp_text, "html.parser")
-        adr = soup.find('table', id='dgResults')
-        if adr is not None:
-            items = []
-            col_names = []
-            trs = adr.findAll("tr")
-            for r, a in enumerate(trs):
-                if r != 0 and r != len(trs) - 1:
-                    current_item = {}
-                    for c, d in enumerate(a.findAll("td")):
-                        if r == 1:
-                            col_names.append(d.get_text(strip=True))
-                        else:
-                            current_item[col_names[c]] = d.get_text(strip=True)
-                    if r > 1:
-                        items.append(current_item)
-            rows = items
-            lds = set()
-            for row in rows:
-                if row['First Legal'] and len(row['First Legal']) > 0:
-                    lds.add(row['First Legal'])
-            for ld in lds:
-                legal_desc = ld.strip()
-                temp = self.get_legal_from_str(legal_desc)
-                if temp:
-                    rets.append(dict(temp.items()))
+        lds = OrderedDict()
+        for row in self.iter_grid_rows(resp_text, ['First Legal']):
+            if row.get('First Legal'):
+                lds[row['First Legal']] = True
+        for ld in lds:
+            legal_desc = ld.strip()
+            temp = self.get_legal_from_str(legal_desc)
+            if temp:
+                rets.append(dict(temp.items()))
         return rets
 
     def fetch(self, case_number_):
@@ -745,6 +1044,110 @@ class BclerkPublicRecords(object):
             return i['name_combos']
 
 
+class LienSearch(object):
+    """Lien documents per case over its defendant name combos; each name is searched once per `ttl`."""
+
+    def __init__(self, bcpr_infra, time_infra, ttl, max_workers=4, file_system_infra=None,
+                 cache_path='outputs/lien_cache.json'):
+        self.bcpr_infra = bcpr_infra
+        self.time_infra = time_infra
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.file_system_infra = file_system_infra
+        self.cache_path = cache_path
+        self.cache = {}
+        if self.file_system_infra is not None:
+            self.cache = self.file_system_infra.load_json(cache_path) or {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_request_info(name):
+        ret = {'uri': 'http://web1.brevardclerk.us/oncoreweb/search.aspx', 'form': {}}
+        ret['form']['txtName'] = name
+        ret['form']['SearchType'] = 'fullname'
+        ret['form']['txtDocTypes'] = ''
+        return ret
+
+    @staticmethod
+    def is_lien(doc_type):
+        doc_type = doc_type.upper()
+        # the foreclosure's own judgment and releases/satisfactions of earlier liens don't count
+        return ('LIEN' in doc_type or 'JUDGMENT' in doc_type) and \
+            not any(x in doc_type for x in ['RELEASE', 'SATISFACTION', 'FORECLOSURE'])
+
+    @staticmethod
+    def get_amount(consideration):
+        try:
+            return float(consideration.replace('$', '').replace(',', ''))
+        except ValueError:
+            return 0.0
+
+    def parse_liens(self, resp_text):
+        rows = BclerkPublicRecords.iter_grid_rows(resp_text, ['CFN', 'DocTypeKey', 'Consideration'])
+        return [{'cfn': x.get('CFN', ''), 'doc_type': x.get('DocTypeKey', ''),
+                 'amount': self.get_amount(x.get('Consideration', ''))}
+                for x in rows if self.is_lien(x.get('DocTypeKey', ''))]
+
+    def get_cached(self, name):
+        with self.lock:
+            entry = self.cache.get(name)
+        if entry is not None and self.time_infra.time() - entry['time'] <= self.ttl:
+            return entry['liens']
+        return None
+
+    def save(self):
+        if self.file_system_infra is None:
+            return
+        now = self.time_infra.time()
+        with self.lock:
+            self.cache = dict((k, v) for k, v in self.cache.items() if now - v['time'] <= self.ttl)
+            self.file_system_infra.save_json(self.cache_path, self.cache)
+
+    def search(self, name):
+        liens = self.get_cached(name)
+        if liens is None:
+            resp_text = self.bcpr_infra.get_resp_from_request(self.get_request_info(name))
+            liens = self.parse_liens(resp_text)
+            with self.lock:
+                self.cache[name] = {'time': self.time_infra.time(), 'liens': liens}
+        return liens
+
+    def fill(self, mrs):
+        names = list(OrderedDict.fromkeys(n for r in mrs for n in (BclerkPublicRecords.get_name_combos(r) or [])))
+        to_fetch = [x for x in names if self.get_cached(x) is None]
+        logging.info('lien search: %d names, %d to fetch', len(names), len(to_fetch))
+
+        def search_one(name):
+            try:
+                return name, self.search(name)
+            except Exception as e:
+                logging.error('lien search failed for %s: %s', name, e)
+                return name, None
+
+        results = {}
+        if len(to_fetch) > 0:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(to_fetch)))) as executor:
+                results.update(executor.map(search_one, to_fetch))
+            self.save()
+        for r in mrs:
+            docs = OrderedDict()
+            failed = False
+            for name in BclerkPublicRecords.get_name_combos(r) or []:
+                liens = results[name] if name in results else self.get_cached(name)
+                if liens is None:
+                    failed = True
+                    continue
+                for lien in liens:
+                    docs[lien['cfn'] or id(lien)] = lien
+            if failed:
+                r['missing_sources'] = set(r.get('missing_sources', set())) | {'liens'}
+                continue
+            if 'liens' in r.get('missing_sources', ()):
+                r['missing_sources'] = set(r['missing_sources']) - {'liens'}
+            r['lien_docs'] = len(docs)
+            r['lien_total'] = sum(x['amount'] for x in docs.values())
+
+
 class ContentHolder(object):
     def __init__(self, content):
         self.content = content
@@ -796,6 +1199,7 @@ class BclerkBeca(object):
         return ret
 
     def get_lad_url_from_rtext(self, r_text):
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(r_text, 'html.parser')
         ret = {'case number': soup.title.text, 'case title': soup.find_all('h5')[0].text}
         items = []
@@ -816,8 +1220,7 @@ class BclerkBeca(object):
                     if the_a:
                         current_item[col_names[c]] = {'href': the_a['href'], 'title': the_a['title']}
                 except (IndexError, KeyError) as error:
-                    logging.debug(' '.join(
-                        ['********exception******', str(error), str(sys.exc_info()[0]), str(col_names), str(d)]))
+                    logging.debug('********exception****** %s %s %s %s', error, sys.exc_info()[0], col_names, d)
 
             items.append(current_item)
         ret['items'] = items
@@ -903,6 +1306,10 @@ class BclerkBeca(object):
 
 
 class MyDate(object):
+    def __init__(self, weeks_num=2):
+        self.weeks_num = weeks_num
+        self.next_dates_cache = {}
+
     @staticmethod
     def get_next_weekday(from_date, next_weekday):
         n = (next_weekday - from_date.weekday()) % 7  # mod-7 ensures we don't go backward in time
@@ -912,14 +1319,16 @@ class MyDate(object):
         return self.get_next_weekday(adate, 2)
 
     def get_next_dates(self, from_date):
+        if from_date in self.next_dates_cache:
+            return self.next_dates_cache[from_date][:]
         ret = []
-        weeks_num = 2  # 6 # hack
         wednesdays = []
-        for x in range(0, weeks_num):
+        for x in range(0, self.weeks_num):
             wednesdays.append(from_date + timedelta(weeks=x))  # was getting a warning when this was a list-compr
         the_dates = [self.get_next_wed_offset(w) for w in wednesdays]
         ret.extend(the_dates)
         ret.sort()
+        self.next_dates_cache[from_date] = ret[:]
         return ret
 
 
@@ -938,6 +1347,7 @@ class Foreclosures(object):
 
     @staticmethod
     def get_rows_from_response(the_html):
+        from bs4 import BeautifulSoup
         rows = []
         soup = BeautifulSoup(the_html, "html.parser")
         trs = soup.find_all("tr")
@@ -957,18 +1367,324 @@ class Foreclosures(object):
     @staticmethod
     def add_foreclosures(all2, limit=None):
         logger = logging.getLogger(__name__)
-        logger.info('all foreclosures:' + str(len(all2)))
+        logger.info('all foreclosures:%d', len(all2))
         to_set = all2
         if limit is not None:
             to_set = all2[:limit]
-        logger.info('to_set:' + str(len(to_set)))
+        logger.info('to_set:%d', len(to_set))
         return to_set
 
 
+class MemoryProfiler(object):
+    """Opt-in tracemalloc deltas per stage (approximate when stages run concurrently)."""
+
+    def __init__(self, enabled=False, top=10):
+        self.enabled = enabled
+        self.top = top
+        self.stages = OrderedDict()
+        self.baseline = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.enabled:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(25)
+            self.baseline = tracemalloc.take_snapshot()
+
+    @contextmanager
+    def stage(self, name, snapshot=False):
+        if not self.enabled or not tracemalloc.is_tracing():
+            yield
+            return
+        before_snapshot = tracemalloc.take_snapshot() if snapshot else None
+        # per-stage peaks need tracemalloc.reset_peak (python 3.9+); without it only the run's peak is reported
+        track_peak = snapshot and hasattr(tracemalloc, 'reset_peak')
+        if track_peak:
+            tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            with self.lock:
+                totals = self.stages.setdefault(name, {'calls': 0, 'delta': 0, 'peak_delta': 0})
+                totals['calls'] += 1
+                totals['delta'] += current - before
+                if track_peak:
+                    totals['peak_delta'] = max(totals['peak_delta'], peak - before)
+            if snapshot:
+                self.log_top(name, tracemalloc.take_snapshot().compare_to(before_snapshot, 'lineno'))
+
+    def wrap(self, name, func):
+        def call(*args, **kwargs):
+            with self.stage(name):
+                return func(*args, **kwargs)
+
+        return call if self.enabled else func
+
+    def log_top(self, title, stats):
+        logging.info('memory top allocators (%s):', title)
+        for stat in stats[:self.top]:
+            logging.info('  %s', stat)
+
+    @staticmethod
+    def get_peak_rss_mb():
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+    def report(self):
+        if not self.enabled or not tracemalloc.is_tracing():
+            return
+        logging.info('memory per stage (calls, net delta, peak above start):')
+        for name, totals in self.stages.items():
+            logging.info('  %-16s %6d %10.1f KiB %10.1f KiB' % (name, totals['calls'], totals['delta'] / 1024.0,
+                                                                totals['peak_delta'] / 1024.0))
+        if self.baseline is not None:
+            self.log_top('run', tracemalloc.take_snapshot().compare_to(self.baseline, 'lineno'))
+        current, peak = tracemalloc.get_traced_memory()
+        logging.info('memory traced current %.1f MiB, traced peak %.1f MiB, peak rss %.1f MiB' % (
+            current / 1048576.0, peak / 1048576.0, self.get_peak_rss_mb()))
+
+
+class CaseJob(object):
+    def __init__(self, r, out_dir_htm):
+        self.r = r
+        self.out_dir_htm = out_dir_htm
+        self.case_info_content = None
+        self.reused = False
+        self.finished = False
+
+
+class CasePriority(object):
+    """Most urgent first: nearest sale, not cancelled, highest known market value, schedule order."""
+
+    def __init__(self, record_store=None):
+        self.record_store = record_store
+
+    def get_market_value(self, r):
+        item = r.get('bcpao_item')
+        if item is None and self.record_store is not None:
+            record = self.record_store.get(r['case_number'])
+            item = record.get('bcpao_item') if record is not None else None
+        value = re.sub('[^0-9.]', '', (item or {}).get('latest market value total') or '')
+        try:
+            return float(value)
+        except ValueError:
+            return 0.0
+
+    def key(self, job):
+        r = job.r
+        return (r.get('foreclosure_sale_date') or date.max, 1 if 'CANCELLED' in r.get('comment', '') else 0,
+                -self.get_market_value(r), r.get('count') or 0)
+
+
+class Stage(object):
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+
+
+class Pipeline(object):
+    """Runs items through stages, each with its own workers behind a bounded queue."""
+    STOP = object()
+    FINISH = 'finish'  # the stage name run() reports when on_done raised
+
+    def __init__(self, stages, queue_size=16, priority=None):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.priority = priority
+
+    def run(self, items, on_done=None):
+        failures = []
+        failures_lock = threading.Lock()
+        if self.priority is None:
+            queues = [Queue(maxsize=self.queue_size) for _ in self.stages]
+        else:
+            queues = [PriorityQueue(maxsize=self.queue_size) for _ in self.stages]
+            # once per item: a key may be costly and must not change as stages fill the item in
+            items = list(items)
+            keys = dict((id(x), self.priority(x)) for x in items)
+            items = sorted(items, key=lambda x: keys[id(x)])
+        seq = itertools.count()
+
+        def put(index, item):
+            if self.priority is None:
+                queues[index].put(item)
+            elif item is self.STOP:
+                # sorts after every item; the previous stage has finished by then anyway
+                queues[index].put((1, None, next(seq), item))
+            else:
+                queues[index].put((0, keys[id(item)], next(seq), item))
+
+        def get(index):
+            entry = queues[index].get()
+            return entry if self.priority is None else entry[-1]
+
+        def work(index):
+            stage = self.stages[index]
+            while True:
+                item = get(index)
+                if item is self.STOP:
+                    return
+                try:
+                    stage.func(item)
+                except Exception as e:
+                    with failures_lock:
+                        failures.append((item, stage.name, e))
+                    continue
+                if index + 1 < len(self.stages):
+                    put(index + 1, item)
+                elif on_done is not None:
+                    try:
+                        on_done(item)
+                    except Exception as e:
+                        # a dead last-stage worker would leave the previous stage blocked on a full queue
+                        with failures_lock:
+                            failures.append((item, self.FINISH, e))
+
+        threads = []
+        for index, stage in enumerate(self.stages):
+            stage_threads = [threading.Thread(target=work, args=(index,), name=stage.name + '-' + str(n), daemon=True)
+                             for n in range(max(1, stage.workers))]
+            for t in stage_threads:
+                t.start()
+            threads.append(stage_threads)
+        for item in items:
+            put(0, item)
+        for index, stage_threads in enumerate(threads):
+            for _ in stage_threads:
+                put(index, self.STOP)
+            for t in stage_threads:
+                t.join()
+        return failures
+
+
+class SourceUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker(object):
+    """Fails fast after `failures` consecutive errors; lets one probe through after `reset_seconds`."""
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, time_infra, failures=5, reset_seconds=120):
+        self.name = name
+        self.time_infra = time_infra
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.consecutive = 0
+        self.opened_at = None
+        self.trips = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.time_infra.time() - self.opened_at >= self.reset_seconds:
+                logging.info('%s circuit half-open, probing', self.name)
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                logging.info('%s circuit closed', self.name)
+            self.state = self.CLOSED
+            self.consecutive = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.consecutive >= self.failures):
+                if self.state == self.CLOSED:
+                    self.trips += 1
+                logging.error('%s circuit open after %d consecutive failures', self.name, self.consecutive)
+                self.state = self.OPEN
+                self.opened_at = self.time_infra.time()
+
+    def call(self, func, *args):
+        if not self.allow():
+            raise SourceUnavailable(self.name + ' circuit open')
+        try:
+            ret = func(*args)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return ret
+
+
+LOG_FORMAT = '%(asctime)s %(module)-15s %(levelname)s %(message)s'
+_log_listener = None
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    # the queue is in-process, so records are formatted on the listener thread, not by the logger
+    def prepare(self, record):
+        return record
+
+
+class JsonEventFormatter(logging.Formatter):
+    def format(self, record):
+        event = dict(getattr(record, 'event', {}))
+        event.update(time=self.formatTime(record), level=record.levelname, message=record.getMessage())
+        return json.dumps(event, default=str, sort_keys=True)
+
+
+def setup_logging(level='DEBUG', fmt=LOG_FORMAT, json_path=None, stream=None):
+    global _log_listener
+    stop_logging()
+    stream_handler = logging.StreamHandler(stream if stream is not None else sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(fmt))
+    handlers = [stream_handler]
+    if json_path:
+        json_handler = logging.FileHandler(json_path)
+        json_handler.setFormatter(JsonEventFormatter())
+        json_handler.addFilter(lambda record: hasattr(record, 'event'))
+        handlers.append(json_handler)
+    log_queue = Queue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(LazyQueueHandler(log_queue))
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    _log_listener = logging.handlers.QueueListener(log_queue, *handlers)
+    _log_listener.start()
+    atexit.unregister(stop_logging)
+    atexit.register(stop_logging)
+    return _log_listener
+
+
+def stop_logging():
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+
+def log_case_event(name, r, level=logging.INFO, **fields):
+    event = {'event': name, 'case_number': r.get('case_number'), 'count': r.get('count')}
+    event.update(fields)
+    logging.getLogger('jac.events').log(level, 'count_id: %s %s %s', r.get('count'), name, fields or '',
+                                        extra={'event': event})
+
+
 class Jac(object):
+    # slow-changing fields carried over from a stored record when its sale date is still on the schedule
+    REUSABLE_KEYS = ['legal', 'legals', 'bcpao_acc', 'bcpao_item']
+    REUSED_STAGES = ['public_records', 'bcpao']
+    # a stage can't run once a stage it reads from is missing (bcpao needs the legal, taxes needs the account)
+    STAGE_DEPENDS = {'bcpao': ['public_records'], 'taxes': ['bcpao']}
+
     def __init__(self, email_infra=None, fore_infra=None, file_system_infra=None, bclerk_beca_infra=None,
                  bcpr_infra=None, taxes_infra=None, bcpao_infra=None, zip_infra=None, time_infra=None,
-                 excel_infra=None):
+                 excel_infra=None, tax_roll_infra=None, record_store=None, backfill_queue=None):
         self.legal = None
         self.legals = None
         self.email_infra = email_infra
@@ -981,48 +1697,232 @@ class Jac(object):
         self.zip_infra = zip_infra
         self.time_infra = time_infra
         self.excel_infra = excel_infra
+        self.tax_roll_infra = tax_roll_infra
+        self.tax_roll_max_age = None
+        self.record_store = record_store
+        self.reuse_max_age = None
+        self.backfill_queue = backfill_queue
+        self.backfill_max_attempts = 5
+        self.backfill_max_age = 7 * 86400
+        self.run_dir = None
         self.my_filter = None
-        logging.basicConfig(format='%(asctime)s %(module)-15s %(levelname)s %(message)s', level=logging.DEBUG,
-                            stream=sys.stdout)
+        self.my_date = MyDate()
+        self.today = None
+        self.enrichment_cache = None
+        self.stage_workers = {}
+        self.queue_size = 16
+        self.mem_profiler = MemoryProfiler()
+        self.breakers = {}
+        self.lien_search = None
+        self.docket_store = None
+        self.case_priority = None
+        self.progress = None
 
     def set_filter(self, my_filter):
         self.my_filter = my_filter
 
+    def get_today(self):
+        if self.today is not None:
+            return self.today
+        return self.time_infra.get_today()
+
+    def set_enrichment_cache(self, enrichment_cache):
+        self.enrichment_cache = enrichment_cache
+
+    def set_stage_workers(self, stage_workers, queue_size=16):
+        self.stage_workers = stage_workers
+        self.queue_size = queue_size
+
+    def set_case_priority(self, case_priority):
+        self.case_priority = case_priority
+
+    def set_circuit_breakers(self, failures, reset_seconds):
+        self.breakers = dict((x, CircuitBreaker(x, self.time_infra, failures, reset_seconds))
+                             for x in ['beca', 'public_records', 'bcpao', 'taxes'])
+
+    def get_pool_sizes(self, lien_workers=0):
+        # one pooled connection per worker that talks to a host; lien searches share the public records host
+        sizes = dict((x, self.stage_workers.get(x, 1)) for x in ['beca', 'public_records', 'bcpao', 'taxes'])
+        sizes['schedule'] = 1
+        sizes['public_records'] += lien_workers
+        return sizes
+
+    @staticmethod
+    def configure_transport(pool_sizes, timeouts=None, preconnect=False, upstream=None, capture=None, replay=None):
+        import transport
+        timeouts = transport.parse_per_source(timeouts, transport.parse_timeout)
+        transport.configure(transport.TransportConfig(pool_sizes, timeouts, preconnect, upstream, capture, replay))
+
+    @staticmethod
+    def parse_stage_workers(arg):
+        ret = {}
+        if arg:
+            for part in arg.split(','):
+                name, workers = part.split('=')
+                ret[name.strip()] = int(workers)
+        return ret
+
     def get_dataset(self, mrs, out_dir_htm, sheet_name):
+        jobs = []
+        done = []
         for i, r in enumerate(mrs):
 
             # if r['count'] not in [71]:  # temp hack
             #     continue
 
-            retries = 3
+            if self.fill_from_checkpoint(r):
+                log_case_event('checkpoint', r)
+                self.mark_progress(r)
+                if not self.has_liens(r):
+                    done.append(self.get_finished_job(r, out_dir_htm))
+                continue
+            if self.fill_from_cache(out_dir_htm, r):
+                log_case_event('cached', r)
+                self.mark_progress(r)
+                done.append(self.get_finished_job(r, out_dir_htm))
+                continue
+            job = CaseJob(r, out_dir_htm)
+            job.reused = self.reuse_stored(r)
+            jobs.append(job)
+        logging.info('%s: %d of %d cases carried over (beca and taxes refreshed only)', sheet_name,
+                     len([x for x in jobs if x.reused]), len(jobs))
+        self.run_pipeline(jobs)
+        if self.lien_search is not None:
+            with self.mem_profiler.stage('liens'):
+                self.lien_search.fill([x.r for x in done + jobs])
+            self.save_liens(done + jobs)
+        sheet_builder = XlBuilder(sheet_name, self.time_infra, self.lien_search is not None)
+        with self.mem_profiler.stage('add_sheet', snapshot=True):
+            dataset = sheet_builder.add_sheet(mrs)
+        return dataset
+
+    def has_liens(self, r):
+        # a checkpoint saved after its lien search (see save_liens)
+        return self.lien_search is not None and 'lien_docs' in r and 'liens' not in r.get('missing_sources', ())
+
+    @staticmethod
+    def get_finished_job(r, out_dir_htm):
+        job = CaseJob(r, out_dir_htm)
+        job.finished = True
+        return job
+
+    def save_liens(self, jobs):
+        # the lien search runs after finish_case, so cases are saved again with the lien columns
+        for job in jobs:
+            if job.finished:
+                self.save_checkpoint(job)
+            self.store_record(job)
+            if 'liens' in job.r.get('missing_sources', ()):
+                self.queue_backfill(job, stages=['liens'])
+
+    def get_stages(self):
+        stages = [Stage('beca', self.fill_beca, self.stage_workers.get('beca', 1)),
+                  Stage('public_records', self.fill_public_records, self.stage_workers.get('public_records', 1)),
+                  Stage('bcpao', self.fill_bcpao, self.stage_workers.get('bcpao', 1)),
+                  Stage('taxes', self.fill_taxes, self.stage_workers.get('taxes', 1))]
+        for stage in stages:
+            stage.func = self.mem_profiler.wrap(stage.name, stage.func)
+        return stages
+
+    def run_pipeline(self, jobs):
+        import requests
+        stages = [Stage(x.name, self.with_breaker(x.name, self.with_retries(x.name, self.guarded(x.name, x.func))),
+                        x.workers) for x in self.get_stages()]
+        priority = self.case_priority.key if self.case_priority is not None else None
+        failures = Pipeline(stages, self.queue_size, priority).run(jobs, self.finish_case)
+        stage_names = [x.name for x in stages]
+        for job, stage_name, e in failures:
+            log_case_event('failed', job.r, logging.ERROR, stage=stage_name, error=str(e))
+            if stage_name == Pipeline.FINISH:
+                continue
+            # the pipeline dropped the case, so this stage and every later one are missing
+            missing = set(stage_names[stage_names.index(stage_name):])
+            job.r['missing_sources'] = job.r.get('missing_sources', set()) | missing
+            self.store_record(job)
+            self.queue_backfill(job, e)
+        for job, stage_name, e in failures:
+            if not isinstance(e, requests.exceptions.Timeout):
+                raise e
+
+    @staticmethod
+    def with_retries(stage_name, func, retries=3):
+        def call(job):
+            import requests
             for attempt in range(retries):
                 try:
-                    attempt_str = '' if attempt == 0 else " (attempt " + str(attempt + 1) + "/" + str(retries) + ")"
-                    logging.info('count_id: ' + str(r['count']) + attempt_str)
-                    self.fill_by_case_number(out_dir_htm, r)
-                    break
+                    return func(job)
                 except requests.exceptions.Timeout as e:
-                    logging.error("exception: " + str(e))
-        sheet_builder = XlBuilder(sheet_name, self.time_infra)
-        dataset = sheet_builder.add_sheet(mrs)
-        return dataset
+                    log_case_event('retry', job.r, logging.ERROR, stage=stage_name, attempt=attempt + 1,
+                                   retries=retries, error=str(e))
+                    if attempt == retries - 1:
+                        raise
+
+        return call
+
+    def guarded(self, stage_name, func):
+        breaker = self.breakers.get(stage_name)
+        if breaker is None:
+            return func
+
+        def call(job):
+            if job.reused and stage_name in self.REUSED_STAGES:
+                return func(job)
+            return breaker.call(func, job)
+
+        return call
+
+    def with_breaker(self, stage_name, func):
+        # an open breaker marks the stage missing instead of dropping the case
+        if stage_name not in self.breakers:
+            return func
+
+        def call(job):
+            missing = job.r.get('missing_sources', set())
+            if any(x in missing for x in self.STAGE_DEPENDS.get(stage_name, [])):
+                job.r['missing_sources'] = missing | {stage_name}
+                return
+            try:
+                func(job)
+            except Exception as e:
+                log_case_event('missing', job.r, logging.ERROR, stage=stage_name, error=str(e))
+                job.r['missing_sources'] = missing | {stage_name}
+
+        return call
 
     def fill_by_case_number(self, out_dir_htm, r):
-        logging.info('case_number: ' + r['case_number'])
+        job = CaseJob(r, out_dir_htm)
+        for stage in self.get_stages():
+            stage.func(job)
+        self.finish_case(job)
+
+    def fill_beca(self, job):
+        r = job.r
+        logging.info('count_id: %s, case_number: %s', r.get('count'), r['case_number'])
         bclerk_beca = BclerkBeca(self.bclerk_beca_infra)
         be = bclerk_beca.pre_cache(r['case_number'])
-        be2 = bclerk_beca.fetch_case_info(be['court_type'], be['id2'], out_dir_htm,
+        be2 = bclerk_beca.fetch_case_info(be['court_type'], be['id2'], job.out_dir_htm,
                                             be['seq_number'], be['year'])
         self.file_system_infra.save_lines_to_file(be2['case_info_html_filepath'], 'wb', be2['case_info_html_content'])
+        job.case_info_content = be2['case_info_html_content'].content
 
         bclerk_beca_info = bclerk_beca.parse_reg_actions_response(be2['text'])
         r['latest_amount_due'] = bclerk_beca_info['latest_amount_due']
         r['orig_mtg_link'] = bclerk_beca_info['orig_mtg_link']
         r['orig_mtg_tag'] = bclerk_beca_info['orig_mtg_tag']
+
+    def fill_public_records(self, job):
+        if job.reused:
+            return
+        r = job.r
         bclerk_public_records = BclerkPublicRecords(self.bcpr_infra)
         bclerk_public_records.fetch(r['case_number'])
         r['legal'] = bclerk_public_records.legal
         r['legals'] = bclerk_public_records.legals
+
+    def fill_bcpao(self, job):
+        if job.reused:
+            return
+        r = job.r
         bcpao = Bcpao(self.bcpao_infra)
         bcpao_info = bcpao.get_bcpao_acc_from_legal(r['legal'], r['legals'])
         r['bcpao_acc'] = bcpao_info['bcpao_acc']
@@ -1031,19 +1931,234 @@ class Jac(object):
         r['bcpao_item'] = bcpao.get_bcpao_item_from_acc(r['bcpao_acc'])
         if r['bcpao_item'] is None:
             r['bcpao_item'] = {}
-        taxes = Taxes(self.taxes_infra)
+
+    def fill_taxes(self, job):
+        r = job.r
+        taxes = Taxes(self.taxes_infra, self.tax_roll_infra, self.tax_roll_max_age)
         taxes_info = taxes.get_info_from_account(r['bcpao_acc'])
         if taxes_info is not None:
             r['taxes_value'] = taxes_info['value_to_use']
             r['taxes_url'] = taxes_info['url_to_use']
+            r['taxes_bills'] = taxes_info['bills']
+            r['taxes_certificates_sold'] = taxes_info['certificates_sold']
+
+    def finish_case(self, job):
+        job.finished = True
+        log_case_event('finished', job.r, reused=job.reused, missing=sorted(job.r.get('missing_sources', ())))
+        # without the docket (beca missing) there is nothing to serve from the cache; the case is refreshed instead
+        if self.enrichment_cache is not None and job.case_info_content is not None:
+            self.enrichment_cache.put(job.r, job.case_info_content)
+        self.save_checkpoint(job)
+        self.store_record(job)
+        self.queue_backfill(job)
+        self.mark_progress(job.r)
+
+    def mark_progress(self, r):
+        if self.progress is not None:
+            self.progress.case_done(r)
+
+    def store_record(self, job):
+        if self.record_store is not None:
+            record = dict(job.r)
+            record['enriched_time'] = job.r.get('enriched_time') if job.reused else self.time_infra.time()
+            self.record_store.put(job.r['case_number'], record)
+
+    def queue_backfill(self, job, e=None, stages=None):
+        if self.backfill_queue is None or self.record_store is None:
+            return
+        for stage_name in sorted(stages if stages is not None else job.r.get('missing_sources', ())):
+            self.backfill_queue.add({'case_number': job.r['case_number'], 'stage': stage_name, 'run_dir': self.run_dir,
+                                     'out_dir_htm': job.out_dir_htm, 'attempts': 0, 'time': self.time_infra.time(),
+                                     'queued_time': self.time_infra.time(),
+                                     'error': str(e) if e is not None else None})
+
+    def backfill(self):
+        if self.backfill_queue is None or self.record_store is None:
+            return 0
+        by_case = OrderedDict()
+        for entry in self.backfill_queue.get_entries():
+            if self.is_backfill_expired(entry):
+                logging.warning('backfill %s %s given up after %d attempts: %s', entry['case_number'], entry['stage'],
+                                entry['attempts'], entry.get('error'))
+                self.backfill_queue.remove(entry['case_number'], entry['stage'])
+                continue
+            by_case.setdefault(entry['case_number'], {})[entry['stage']] = entry
+        patched = 0
+        run_dirs = []
+        for case_number, entries in by_case.items():
+            r = self.record_store.get(case_number)
+            if r is None:
+                for stage_name in entries:
+                    self.backfill_queue.remove(case_number, stage_name)
+                continue
+            r['missing_sources'] = set(r.get('missing_sources', [])) | set(entries)
+            first = list(entries.values())[0]
+            job = CaseJob(r, first['out_dir_htm'])
+            failed = False
+            for stage in self.get_stages():
+                if stage.name not in r['missing_sources']:
+                    continue
+                try:
+                    self.with_retries(stage.name, self.guarded(stage.name, stage.func))(job)
+                except Exception as e:
+                    logging.error('backfill %s %s failed again: %s', case_number, stage.name, e)
+                    for stage_name in r['missing_sources']:
+                        entry = entries.get(stage_name, dict(first, stage=stage_name, attempts=0))
+                        entry.update(attempts=entry['attempts'] + 1, time=self.time_infra.time(), error=str(e))
+                        self.backfill_queue.add(entry)
+                    failed = True
+                    break
+                r['missing_sources'].discard(stage.name)
+                if stage.name in entries:
+                    self.backfill_queue.remove(case_number, stage.name)
+                patched += 1
+            if not failed and 'liens' in r['missing_sources'] and self.lien_search is not None:
+                self.lien_search.fill([r])
+                if 'liens' in r['missing_sources']:
+                    entry = entries.get('liens', dict(first, stage='liens', attempts=0))
+                    entry.update(attempts=entry['attempts'] + 1, time=self.time_infra.time(),
+                                 error='lien search failed')
+                    self.backfill_queue.add(entry)
+                else:
+                    self.backfill_queue.remove(case_number, 'liens')
+                    patched += 1
+            if len(r['missing_sources']) == 0:
+                del r['missing_sources']
+            self.record_store.put(case_number, r)
+            for run_dir in sorted(set(x['run_dir'] for x in entries.values() if x.get('run_dir'))):
+                self.update_checkpoint(run_dir, r)
+                if run_dir not in run_dirs:
+                    run_dirs.append(run_dir)
+        for run_dir in run_dirs:
+            self.patch_workbook(run_dir)
+        logging.info('backfill patched %d stages across %d runs', patched, len(run_dirs))
+        return patched
+
+    def is_backfill_expired(self, entry):
+        if self.backfill_max_attempts and entry['attempts'] >= self.backfill_max_attempts:
+            return True
+        queued = entry.get('queued_time', entry['time'])
+        return bool(self.backfill_max_age) and self.time_infra.time() - queued > self.backfill_max_age
+
+    def set_backfill_limits(self, max_attempts, max_age):
+        self.backfill_max_attempts = max_attempts
+        self.backfill_max_age = max_age
+
+    def write_run_manifest(self, filename, out_dir, single_date_item_sets, run_tag=None, date_counts=None):
+        # what --resume and backfill need without the live schedule
+        sheets = [{'dataset_title': x['dataset_title'], 'case_numbers': [r['case_number'] for r in x['items']],
+                   'items': x['items']} for x in single_date_item_sets]
+        self.file_system_infra.save_json(out_dir + '/manifest.json', {'filename': filename, 'run_tag': run_tag,
+                                                                      'date_counts': date_counts, 'sheets': sheets})
+
+    def get_checkpoint_path(self, r, run_dir=None):
+        return (run_dir or self.run_dir) + '/checkpoints/' + r['case_number'] + '.json'
+
+    def save_checkpoint(self, job):
+        if self.run_dir is not None:
+            self.file_system_infra.save_json(self.get_checkpoint_path(job.r), job.r)
+
+    def update_checkpoint(self, run_dir, r):
+        # so that --resume and --rebuild of that run see what backfill patched
+        path = self.get_checkpoint_path(r, run_dir)
+        if os.path.exists(path):
+            self.file_system_infra.save_json(path, r)
+
+    def fill_from_checkpoint(self, r):
+        if self.run_dir is None:
+            return False
+        checkpoint = self.file_system_infra.load_json(self.get_checkpoint_path(r))
+        if checkpoint is None:
+            return False
+        r.update(checkpoint)
+        return True
+
+    def patch_workbook(self, run_dir):
+        manifest = self.file_system_infra.load_json(run_dir + '/manifest.json')
+        if manifest is None:
+            logging.warning('no manifest in %s, workbook not patched', run_dir)
+            return
+        datasets = []
+        for sheet in manifest['sheets']:
+            mrs = [self.record_store.get(x) for x in sheet['case_numbers']]
+            if None in mrs:
+                logging.warning('records missing for %s, workbook not patched', run_dir)
+                return
+            sheet_builder = XlBuilder(sheet['dataset_title'], self.time_infra, self.lien_search is not None)
+            datasets.append(sheet_builder.add_sheet(mrs))
+        self.render_workbook(datasets, self.excel_infra.get_a_book(), run_dir + '/' + manifest['filename'])
+
+    def rebuild(self, run_dir, do_zip=False):
+        # offline: the manifest, each case's checkpoint (or stored record) and the saved dockets
+        out_dir = run_dir.rstrip('/')
+        parent_out_dir = os.path.dirname(out_dir) or '.'
+        manifest = self.file_system_infra.load_json(out_dir + '/manifest.json')
+        if manifest is None:
+            logging.error('nothing to rebuild, no manifest.json in %s', out_dir)
+            return 1
+        if self.docket_store is None:
+            self.docket_store = DocketParseStore(self.file_system_infra)
+        self.run_dir = out_dir
+        datasets = []
+        mrs = []
+        for sheet in manifest['sheets']:
+            out_dir_htm = out_dir + '/' + sheet['dataset_title'] + '/html_files'
+            items = []
+            for r in sheet['items']:
+                saved = self.file_system_infra.load_json(self.get_checkpoint_path(r))
+                if saved is None and self.record_store is not None:
+                    saved = self.record_store.get(r['case_number'])
+                if saved is not None:
+                    r.update(saved)
+                else:
+                    logging.warning('no saved enrichment for %s', r['case_number'])
+                docket = self.file_system_infra.load_case_info(
+                    out_dir_htm + '/' + Item.get_id2_from_item(r) + '_case_info.htm')
+                if docket is not None:
+                    r.update(self.docket_store.parse(docket))
+                items.append(r)
+            sheet_builder = XlBuilder(sheet['dataset_title'], self.time_infra, self.lien_search is not None)
+            datasets.append(sheet_builder.add_sheet(items))
+            mrs.extend(items)
+        self.render_workbook(datasets, self.excel_infra.get_a_book(), out_dir + '/' + manifest['filename'])
+        body = self.get_email_body(manifest['run_tag'], manifest['date_counts'], manifest['filename'], mrs)
+        self.file_system_infra.save_content_to_file(out_dir + '/email_body.htm', 'w', body)
+        if do_zip:
+            self.zip_infra.do_zip(out_dir, parent_out_dir, manifest['run_tag'])
+        logging.info('rebuilt %s (%d cases)', os.path.abspath(out_dir), len(mrs))
+        return 0
 
-            # if i == 0:  # temp hack
-            #     break
+    def reuse_stored(self, r):
+        # only for a sale date carried over from an earlier run's horizon
+        if self.record_store is None or self.reuse_max_age is None:
+            return False
+        record = self.record_store.get(r['case_number'])
+        if record is None or record.get('foreclosure_sale_date') != r['foreclosure_sale_date']:
+            return False
+        if any(k not in record for k in self.REUSABLE_KEYS) or record.get('enriched_time') is None:
+            return False
+        if self.time_infra.time() - record['enriched_time'] > self.reuse_max_age:
+            return False
+        for k in self.REUSABLE_KEYS:
+            r[k] = record[k]
+        r['enriched_time'] = record['enriched_time']
+        return True
+
+    def fill_from_cache(self, out_dir_htm, r):
+        if self.enrichment_cache is None:
+            return False
+        entry = self.enrichment_cache.get(r)
+        if entry is None:
+            return False
+        r.update(entry['fields'])
+        id2 = Item.get_id2_from_item(r)
+        self.file_system_infra.save_lines_to_file(out_dir_htm + '/' + id2 + '_case_info.htm', 'wb', entry['content'])
+        return True
 
     def get_non_cancelled_nums(self, mrs):
-        mrs = FilterCancelled().apply(mrs)
-        date_counts = pprint.pformat(self.get_dates_count_map(mrs)).replace('\n', '<br>').replace(
-            'datetime(', '').replace(', 0, 0', '').replace(', ', '/').replace(')', '')
+        index = mrs if isinstance(mrs, ScheduleIndex) else ScheduleIndex(mrs)
+        date_counts = pprint.pformat(index.count_by_date(WithStatus(ScheduleIndex.ACTIVE))).replace(
+            '\n', '<br>').replace('datetime(', '').replace(', 0, 0', '').replace(', ', '/').replace(')', '')
         return date_counts
 
     @staticmethod
@@ -1075,73 +2190,222 @@ class Jac(object):
         parser.add_argument("--zip", action='store_true', help="do zip.")
         parser.add_argument("--email", action='store_true', help="do email.")
         parser.add_argument("--passw", help="email password.")
+        parser.add_argument("--case", action='append', help="only look up this case number (repeatable).")
+        parser.add_argument("--stage-workers", default='beca=2,public_records=2,bcpao=4,taxes=4',
+                            help="worker threads per enrichment stage, e.g. beca=2,bcpao=4.")
+        parser.add_argument("--priority", choices=['urgency', 'schedule'], default='urgency',
+                            help="enrichment order: nearest sale, not cancelled, highest known value first; or count.")
+        parser.add_argument("--queue-size", type=int, default=16, help="bound on cases queued between stages.")
+        parser.add_argument("--tax-roll", help="bulk tax-roll/delinquency file to answer taxes from before scraping.")
+        parser.add_argument("--tax-roll-account-column", default='account', help="account column in --tax-roll.")
+        parser.add_argument("--tax-roll-amount-column", default='amount_due', help="amount column in --tax-roll.")
+        parser.add_argument("--tax-roll-max-age-days", type=float, default=7, help="scrape instead once older.")
+        parser.add_argument("--upstream", help="send all upstream requests to this stand-in server (see replay.py).")
+        parser.add_argument("--capture", help="record all upstream traffic into this archive (zip).")
+        parser.add_argument("--replay-archive", help="answer all upstream requests from a --capture archive.")
+        parser.add_argument("--timeouts",
+                            help="per source [connect:]read timeouts in seconds, e.g. beca=10:100,taxes=20.")
+        parser.add_argument("--preconnect", action='store_true', help="connect to all upstream hosts up front.")
+        parser.add_argument("--today", help="run as if today were this date (YYYY-MM-DD), e.g. for replays.")
+        parser.add_argument("--weeks", type=int, default=2, help="number of weekly sale dates to report on.")
+        parser.add_argument("--reuse-days", type=float, default=28,
+                            help="reuse stored legal/bcpao data for carried-over sale dates enriched this recently.")
+        parser.add_argument("--breaker-failures", type=int, default=5,
+                            help="consecutive failures before a source is skipped (0 disables the breakers).")
+        parser.add_argument("--breaker-reset-seconds", type=float, default=120,
+                            help="how long a tripped source is skipped before it is probed again.")
+        parser.add_argument("--backfill", action='store_true',
+                            help="only retry queued failed stages and patch the stored records and workbooks.")
+        parser.add_argument("--backfill-max-attempts", type=int, default=5,
+                            help="drop a queued backfill after this many failed retries (0 for no limit).")
+        parser.add_argument("--backfill-max-days", type=float, default=7,
+                            help="drop a queued backfill this long after it was queued (0 for no limit).")
+        parser.add_argument("--resume", help="finish an interrupted run in this outputs/<timestamp> directory.")
+        parser.add_argument("--progress-cases", type=int, default=25,
+                            help="write a partial workbook every this many finished cases (0 for never).")
+        parser.add_argument("--progress-seconds", type=float, default=120,
+                            help="and at least this often while cases finish (0 for never).")
+        parser.add_argument("--rebuild", help="re-render this outputs/<timestamp> run from its saved files, offline.")
+        parser.add_argument("--delta-zip", action='store_true',
+                            help="with --zip, only include files changed since the last delivered run.")
+        parser.add_argument("--liens", action='store_true', help="search liens for each defendant and add columns.")
+        parser.add_argument("--lien-ttl-hours", type=float, default=24, help="how long a name's lien search is reused.")
+        parser.add_argument("--lien-workers", type=int, default=4, help="concurrent lien name searches.")
+        parser.add_argument("--log-level", default='DEBUG', help="root log level, e.g. INFO.")
+        parser.add_argument("--log-format", default=LOG_FORMAT, help="logging format string for the console.")
+        parser.add_argument("--log-json", help="also write per-case events as JSON lines to this file.")
+        parser.add_argument("--memprofile", action='store_true', help="log tracemalloc per-stage memory use.")
+        parser.add_argument("--daemon", action='store_true', help="keep running, refreshing and reporting on schedule.")
+        parser.add_argument("--poll-minutes", type=float, default=30, help="daemon schedule poll cadence.")
+        parser.add_argument("--max-age-hours", type=float, default=12, help="daemon enrichment freshness.")
+        parser.add_argument("--report-weekday", type=int, default=0, help="daemon report day (0 is monday).")
+        parser.add_argument("--report-hour", type=int, default=6, help="daemon report hour (local time).")
 
         args = parser.parse_args()
+        setup_logging(args.log_level, args.log_format, args.log_json)
+        if args.today:
+            self.today = datetime.strptime(args.today, '%Y-%m-%d').date()
+        self.mem_profiler = MemoryProfiler(args.memprofile)
+        self.my_date = MyDate(args.weeks)
+        self.reuse_max_age = args.reuse_days * 86400
+        self.set_stage_workers(self.parse_stage_workers(args.stage_workers), args.queue_size)
+        if args.liens:
+            self.lien_search = LienSearch(self.bcpr_infra, self.time_infra, args.lien_ttl_hours * 3600,
+                                          args.lien_workers, self.file_system_infra)
+        self.set_case_priority(CasePriority(self.record_store) if args.priority == 'urgency' else None)
+        self.configure_transport(self.get_pool_sizes(args.lien_workers if args.liens else 0), args.timeouts,
+                                 args.preconnect, args.upstream, args.capture, args.replay_archive)
+        if args.progress_cases > 0 or args.progress_seconds > 0:
+            self.progress = ProgressiveWorkbook(self.file_system_infra, self.excel_infra, self.time_infra,
+                                                args.progress_cases, args.progress_seconds, args.liens)
+        if args.breaker_failures > 0:
+            self.set_circuit_breakers(args.breaker_failures, args.breaker_reset_seconds)
+        if args.tax_roll and self.tax_roll_infra is not None:
+            self.tax_roll_infra.open(args.tax_roll, args.tax_roll_account_column, args.tax_roll_amount_column)
+            self.tax_roll_max_age = args.tax_roll_max_age_days * 86400
+        if args.daemon:
+            self.set_enrichment_cache(EnrichmentCache(self.time_infra, args.max_age_hours * 3600))
+            daemon = JacDaemon(self, args.poll_minutes * 60, args.report_weekday, args.report_hour)
+            return daemon.run(args)
+        self.set_backfill_limits(args.backfill_max_attempts, args.backfill_max_days * 86400)
+        if args.rebuild:
+            return self.rebuild(args.rebuild, args.zip)
+        if args.backfill:
+            self.backfill()
+            return 0
+        if args.case:
+            for case_number in args.case:
+                self.get_by_case_number(case_number)
+            return 0
         return self.go2(args)
 
     def go2(self, args):
+        try:
+            return self.run_report(args)
+        finally:
+            # checkpoints belong to the run; a daemon refreshing cases afterwards must not rewrite a delivered run's
+            self.run_dir = None
+
+    def run_report(self, args):
         logging.info('START')
         start = self.time_infra.time()
         logging.debug('jac starting')
-        logging.info('args: ' + str(args))
-        dates = MyDate().get_next_dates(self.time_infra.get_today())
-        s = Foreclosures(self.fore_infra)
-        mrs = s.get_items()
-        timestamp = self.time_infra.time_strftime('%Y-%m-%d__%H-%M-%S')
-        all_foreclosures = mrs[:]
-        date_counts = self.get_non_cancelled_nums(all_foreclosures)
-        logging.info(dates)
-        short_date_strings_to_add = self.get_short_date_strings_to_add(dates)
-        logging.info('short_date_strings_to_add: ' + str(short_date_strings_to_add))
-        run_tag = '-'.join(short_date_strings_to_add[0:1])
-        parent_out_dir = 'outputs'
-        out_dir = parent_out_dir + '/' + timestamp
-        self.file_system_infra.do_mkdirs(out_dir)
-        logging.info(os.path.abspath(out_dir))
-        filename = run_tag + '.xls'
-        logging.info('date_strings_to_add: ' + str(dates))
-        logging.info('abc: ' + run_tag)
-        # mrs = [mrs[0]]  # temp hack
-        # mrs = mrs[:10]  # temp hack
-        mrs = [x for x in mrs if self.my_filter(x)]
-        single_date_item_sets = []
-        for date_str in dates:
-            filter_by_dates = FilterByDates()
-            filter_by_dates.set_dates([date_str])
-            sheet_name = date_str.strftime("%m-%d")
-            single_date_item_sets.append({'dataset_title': sheet_name, 'items': filter_by_dates.apply(mrs)})
+        logging.info('args: %s', args)
+        if self.tax_roll_infra is not None and self.tax_roll_infra.is_open():
+            logging.info('tax roll rows added: %s', self.tax_roll_infra.load())
+        self.backfill()
+        self.mem_profiler.start()
+        resume_dir = getattr(args, 'resume', None)
+        if resume_dir:
+            out_dir = resume_dir.rstrip('/')
+            parent_out_dir = os.path.dirname(out_dir) or '.'
+            manifest = self.file_system_infra.load_json(out_dir + '/manifest.json')
+            if manifest is None:
+                logging.error('nothing to resume, no manifest.json in %s', out_dir)
+                return 1
+            run_tag, filename, date_counts = manifest['run_tag'], manifest['filename'], manifest['date_counts']
+            single_date_item_sets = [{'dataset_title': x['dataset_title'], 'items': x['items']}
+                                     for x in manifest['sheets']]
+            mrs = [r for x in single_date_item_sets for r in x['items']]
+            logging.info('resuming %s', os.path.abspath(out_dir))
+            self.run_dir = out_dir
+        else:
+            dates = self.my_date.get_next_dates(self.get_today())
+            s = Foreclosures(self.fore_infra)
+            with self.mem_profiler.stage('schedule', snapshot=True):
+                mrs = s.get_items()
+            timestamp = self.time_infra.time_strftime('%Y-%m-%d__%H-%M-%S')
+            schedule = ScheduleIndex(mrs)
+            date_counts = self.get_non_cancelled_nums(schedule)
+            logging.info(dates)
+            short_date_strings_to_add = self.get_short_date_strings_to_add(dates)
+            logging.info('short_date_strings_to_add: %s', short_date_strings_to_add)
+            run_tag = '-'.join(short_date_strings_to_add[0:1])
+            parent_out_dir = 'outputs'
+            out_dir = parent_out_dir + '/' + timestamp
+            self.file_system_infra.do_mkdirs(out_dir)
+            logging.info(os.path.abspath(out_dir))
+            filename = run_tag + '.xls'
+            logging.info('date_strings_to_add: %s', dates)
+            logging.info('abc: %s', run_tag)
+            # mrs = [mrs[0]]  # temp hack
+            # mrs = mrs[:10]  # temp hack
+            schedule = schedule.filter(self.my_filter)
+            mrs = schedule.items
+            single_date_item_sets = []
+            for date_str in dates:
+                sheet_name = date_str.strftime("%m-%d")
+                single_date_item_sets.append({'dataset_title': sheet_name,
+                                              'items': schedule.query(OnDates([date_str]))})
+            self.run_dir = out_dir
+            self.write_run_manifest(filename, out_dir, single_date_item_sets, run_tag, date_counts)
         self.create_workbook_from_item_sets(filename, out_dir, single_date_item_sets, self.excel_infra.get_a_book())
         body = self.get_email_body(run_tag, date_counts, filename, mrs)
         file_paths = [(out_dir + '/' + filename)]
+        delivered_files = None
         if args.zip:
-            final_zip_path = self.zip_infra.do_zip(out_dir, parent_out_dir, run_tag)
+            with self.mem_profiler.stage('zip', snapshot=True):
+                if getattr(args, 'delta_zip', False):
+                    final_zip_path, delivered_files = self.do_delta_zip(out_dir, parent_out_dir, run_tag)
+                else:
+                    final_zip_path = self.zip_infra.do_zip(out_dir, parent_out_dir, run_tag)
 
             file_paths.append(final_zip_path)
         subject = '[jac biweekly report]' + ' for: ' + run_tag
-        if args.email and args.passw:
-            self.my_send_mail(file_paths, args.passw, subject, body)
+        self.deliver(args, file_paths, subject, body, parent_out_dir, run_tag, delivered_files)
         logging.info(body)
-        logging.info('duration %s' % timedelta(seconds=self.time_infra.time() - start))
+        self.mem_profiler.report()
+        logging.info('duration %s', timedelta(seconds=self.time_infra.time() - start))
         logging.info('END')
         return 0
 
+    def deliver(self, args, file_paths, subject, body, parent_out_dir, run_tag, delivered_files=None):
+        # a delta zip's files only count as delivered once the email has gone out
+        if not (args.email and args.passw):
+            if delivered_files is not None:
+                logging.info('not emailed, delivered.json left as is')
+            return False
+        self.my_send_mail(file_paths, args.passw, subject, body)
+        if delivered_files is not None:
+            self.file_system_infra.save_json(parent_out_dir + '/delivered.json',
+                                             {'run_tag': run_tag, 'files': delivered_files})
+        return True
+
+    def do_delta_zip(self, out_dir, parent_out_dir, run_tag):
+        delivered = self.file_system_infra.load_json(parent_out_dir + '/delivered.json') or {}
+        final_zip_path, files = self.zip_infra.do_delta_zip(out_dir, parent_out_dir, run_tag,
+                                                            delivered.get('files', {}), delivered.get('run_tag'))
+        logging.info('delta zip against %s: %s', delivered.get('run_tag'), final_zip_path)
+        return final_zip_path, files
+
     def create_workbook_from_item_sets(self, filename, out_dir, single_date_item_sets, book):
         datasets = []
-        for single_date_item_set in single_date_item_sets:
+        if self.progress is not None:
+            self.progress.start(out_dir, filename, single_date_item_sets)
+        for index, single_date_item_set in enumerate(single_date_item_sets):
             sheet_name = single_date_item_set['dataset_title']
             out_dir_htm = out_dir + '/' + sheet_name + '/html_files'
-            self.file_system_infra.do_mkdirs(out_dir_htm)
+            if not os.path.exists(out_dir_htm):
+                self.file_system_infra.do_mkdirs(out_dir_htm)
 
             mrs_for_one_day = single_date_item_set['items']
-            logging.info('**get_dataset: ' + sheet_name)
+            logging.info('**get_dataset: %s', sheet_name)
             dataset = self.get_dataset(mrs_for_one_day, out_dir_htm, sheet_name)
 
             logging.info('sheet fetch complete')
-            logging.info('sheet num records: ' + str(len(mrs_for_one_day)))
+            logging.info('sheet num records: %d', len(mrs_for_one_day))
             datasets.append(dataset)
+            if self.progress is not None and index + 1 < len(single_date_item_sets):
+                self.progress.sheet_done(index, dataset)
+        self.render_workbook(datasets, book, out_dir + '/' + filename)
+        if self.progress is not None:
+            self.progress.finish()
+
+    def render_workbook(self, datasets, book, path):
         for dataset in datasets:
-            Xl().add_data_set_sheet(dataset, book)
-        book.save(out_dir + '/' + filename)
+            with self.mem_profiler.stage('add_data_set_sheet', snapshot=True):
+                Xl().add_data_set_sheet(dataset, book)
+        book.save(path)
 
     def get_email_body(self, run_tag, date_counts, filename, mrs):
         body = 'this result is for: ' + run_tag
@@ -1151,9 +2415,21 @@ class Jac(object):
         body += '<a href="http://vweb2.brevardclerk.us/Foreclosures/foreclosure_sales.html">foreclosure sales page</a> '
         body += 'as of now: <br>' + date_counts
         body += '<br><br>' + filename
+        body += self.get_missing_sources_str(mrs)
         body += self.get_no_addr_str(mrs)
         return body
 
+    @staticmethod
+    def get_missing_sources_str(mrs):
+        counts = {}
+        for x in mrs:
+            for source in x.get('missing_sources', ()):
+                counts[source] = counts.get(source, 0) + 1
+        if len(counts) == 0:
+            return ''
+        return '<br><br>sources unavailable (columns marked ' + XlBuilder.MISSING + '): ' + ', '.join(
+            k + ' (' + str(counts[k]) + ' cases)' for k in sorted(counts))
+
     @staticmethod
     def get_no_addr_str(mrs):
         no_addr = [x for x in mrs if 'bcpao_item' not in x or
@@ -1174,7 +2450,322 @@ class Jac(object):
             no_addr_str = "\n\n<br><br>could not get addresses for the following: <br>\n" + '<br>\n'.join(ids)
         return no_addr_str
 
-    def get_by_case_number(self, case_number):
+    def lookup_case_number(self, case_number, out_dir_htm=''):
         r = {'case_number': case_number}
-        self.fill_by_case_number('', r)
+        self.fill_by_case_number(out_dir_htm, r)
+        return r
+
+    def get_by_case_number(self, case_number):
+        r = self.lookup_case_number(case_number)
         print('r: ' + str(r))
+
+
+class EnrichmentCache(object):
+    ENRICHED_KEYS = ['latest_amount_due', 'orig_mtg_link', 'orig_mtg_tag', 'legal', 'legals', 'bcpao_acc',
+                     'bcpao_item', 'taxes_value', 'taxes_url', 'taxes_bills', 'taxes_certificates_sold']
+
+    def __init__(self, time_infra, max_age):
+        self.time_infra = time_infra
+        self.max_age = max_age
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def put(self, r, content):
+        fields = dict((k, r[k]) for k in self.ENRICHED_KEYS if k in r)
+        with self.lock:
+            self.entries[r['case_number']] = {'time': self.time_infra.time(), 'fields': fields,
+                                              'content': list(content)}
+
+    def get(self, r):
+        with self.lock:
+            entry = self.entries.get(r['case_number'])
+        if entry is not None and self.time_infra.time() - entry['time'] <= self.max_age:
+            return entry
+        return None
+
+    def is_fresh(self, r):
+        return self.get(r) is not None
+
+
+class DocketParseStore(object):
+    """Parsed beca dockets keyed by a hash of the html and VERSION, in memory and as json files."""
+    VERSION = 1  # part of the key; bump it when the parsing changes
+
+    def __init__(self, file_system_infra, cache_dir='outputs/parsed_dockets', parse=None):
+        self.file_system_infra = file_system_infra
+        self.cache_dir = cache_dir
+        self.parse_func = parse if parse is not None else BclerkBeca().parse_reg_actions_response
+        self.memo = {}
+        self.lock = threading.Lock()
+
+    def get_key(self, content_txt):
+        return hashlib.sha256(content_txt.encode('utf-8')).hexdigest() + '-v' + str(self.VERSION)
+
+    def parse(self, content_txt):
+        key = self.get_key(content_txt)
+        with self.lock:
+            ret = self.memo.get(key)
+        if ret is None:
+            path = self.cache_dir + '/' + key + '.json'
+            ret = self.file_system_infra.load_json(path)
+            if ret is None:
+                ret = self.parse_func(content_txt)
+                self.file_system_infra.save_json(path, ret)
+            with self.lock:
+                self.memo[key] = ret
+        return json.loads(json.dumps(ret))
+
+
+class ProgressiveWorkbook(object):
+    """A partial workbook and progress.json for the run so far, rendered on a writer thread."""
+
+    def __init__(self, file_system_infra, excel_infra, time_infra, every_cases=25, every_seconds=120,
+                 lien_columns=False):
+        self.file_system_infra = file_system_infra
+        self.excel_infra = excel_infra
+        self.time_infra = time_infra
+        self.every_cases = every_cases
+        self.every_seconds = every_seconds
+        self.lien_columns = lien_columns
+        self.lock = threading.Condition()
+        self.partial_path = None
+        self.progress_path = None
+        self.sheets = []
+        self.done = set()
+        self.written_done = 0
+        self.written_time = None
+        self.requested = 0
+        self.completed = 0
+        self.writer = None
+
+    def start(self, out_dir, filename, single_date_item_sets):
+        with self.lock:
+            self.partial_path = out_dir + '/' + os.path.splitext(filename)[0] + '.partial.xls'
+            self.progress_path = out_dir + '/progress.json'
+            self.sheets = [{'title': x['dataset_title'], 'items': x['items'], 'dataset': None}
+                           for x in single_date_item_sets]
+            self.done = set()
+            self.written_done = 0
+            self.written_time = self.time_infra.time()
+            self.requested = self.completed = 0
+            self.writer = threading.Thread(target=self.run_writer, name='progress-writer', daemon=True)
+            self.writer.start()
+
+    def case_done(self, r):
+        with self.lock:
+            if self.partial_path is None:  # not during a workbook run
+                return
+            self.done.add(r['case_number'])
+            if self.is_due():
+                self.request_write()
+
+    def sheet_done(self, index, dataset):
+        with self.lock:
+            self.sheets[index]['dataset'] = dataset
+            self.request_write()
+
+    def is_due(self):
+        pending = self.requested > self.completed
+        if pending:
+            return False
+        if self.every_cases and len(self.done) - self.written_done >= self.every_cases:
+            return True
+        return bool(self.every_seconds) and self.time_infra.time() - self.written_time >= self.every_seconds
+
+    def request_write(self):
+        self.requested += 1
+        self.lock.notify_all()
+
+    def flush(self, timeout=None):
+        with self.lock:
+            target = self.requested
+            return self.lock.wait_for(lambda: self.completed >= target or self.writer is None, timeout)
+
+    def run_writer(self):
+        while True:
+            with self.lock:
+                self.lock.wait_for(lambda: self.requested > self.completed or self.partial_path is None)
+                if self.partial_path is None:
+                    return
+                target = self.requested
+                sheets = [dict(x) for x in self.sheets]
+                done = set(self.done)
+                partial_path, progress_path = self.partial_path, self.progress_path
+            try:
+                self.write(sheets, done, partial_path, progress_path)
+            except Exception:
+                logging.exception('could not write the partial workbook')
+            with self.lock:
+                self.written_done = len(done)
+                self.written_time = self.time_infra.time()
+                self.completed = target
+                self.lock.notify_all()
+
+    def get_progress(self, sheets, done, complete=False):
+        sheets = [{'title': x['title'], 'total': len(x['items']), 'complete': complete or x['dataset'] is not None,
+                   'done': len([r for r in x['items'] if r['case_number'] in done])} for x in sheets]
+        return {'done': sum(x['done'] for x in sheets), 'total': sum(x['total'] for x in sheets),
+                'complete': complete, 'time': self.time_infra.time(), 'sheets': sheets}
+
+    def write(self, sheets, done, partial_path, progress_path):
+        book = self.excel_infra.get_a_book()
+        for sheet in sheets:
+            dataset = sheet['dataset']
+            if dataset is None:
+                rows = [r for r in sheet['items'] if r['case_number'] in done]
+                if len(rows) == 0:
+                    continue
+                title = sheet['title'] + ' partial of ' + str(len(sheet['items']))
+                dataset = XlBuilder(title, self.time_infra, self.lien_columns).add_sheet(rows)
+            Xl().add_data_set_sheet(dataset, book)
+        progress = self.get_progress(sheets, done)
+        if progress['done'] > 0:
+            self.file_system_infra.save_book(book, partial_path)
+        self.file_system_infra.save_json(progress_path, progress)
+        logging.info('partial workbook: %d of %d cases', progress['done'], progress['total'])
+
+    def finish(self):
+        with self.lock:
+            partial_path, progress_path = self.partial_path, self.progress_path
+            self.partial_path = None
+            self.lock.notify_all()
+            writer, self.writer = self.writer, None
+        if writer is not None:
+            writer.join()
+        try:
+            self.file_system_infra.remove_file(partial_path)
+            self.file_system_infra.save_json(progress_path, self.get_progress(self.sheets, self.done, complete=True))
+        except Exception:
+            logging.exception('could not finish the partial workbook')
+
+
+class JacDaemon(object):
+    """Keeps one Jac (and its infra sessions) alive, refreshing enrichment between scheduled reports."""
+
+    def __init__(self, jac, poll_seconds, report_weekday, report_hour, cache_dir='outputs/cache'):
+        self.jac = jac
+        self.poll_seconds = poll_seconds
+        self.report_weekday = report_weekday
+        self.report_hour = report_hour
+        self.cache_dir_htm = cache_dir + '/html_files'
+        self.last_report_date = None
+        self.refresher = None
+
+    def get_items_to_refresh(self):
+        dates = self.jac.my_date.get_next_dates(self.jac.get_today())
+        mrs = ScheduleIndex(Foreclosures(self.jac.fore_infra).get_items()).query(OnDates(dates))
+        return [x for x in mrs if self.jac.my_filter(x) and not self.jac.enrichment_cache.is_fresh(x)]
+
+    def refresh(self, mrs):
+        for r in mrs:
+            try:
+                self.jac.fill_by_case_number(self.cache_dir_htm, r)
+            except Exception as e:
+                logging.error('refresh failed for %s: %s', r['case_number'], e)
+
+    def poll(self):
+        if self.refresher is not None and self.refresher.is_alive():
+            return
+        mrs = self.get_items_to_refresh()
+        logging.info('daemon refreshing %d cases', len(mrs))
+        if len(mrs) > 0:
+            self.refresher = threading.Thread(target=self.refresh, args=(mrs,), daemon=True)
+            self.refresher.start()
+
+    def is_report_due(self, now):
+        return (now.weekday() == self.report_weekday and now.hour >= self.report_hour and
+                self.last_report_date != now.date())
+
+    def tick(self, args):
+        self.poll()
+        now = self.jac.time_infra.now()
+        if self.is_report_due(now):
+            if self.refresher is not None:
+                self.refresher.join()
+            self.jac.go2(args)
+            self.last_report_date = now.date()
+
+    def run(self, args):
+        if not os.path.exists(self.cache_dir_htm):
+            self.jac.file_system_infra.do_mkdirs(self.cache_dir_htm)
+        while True:
+            try:
+                self.tick(args)
+            except Exception as e:
+                logging.error('daemon tick failed: %s', e)
+            self.jac.time_infra.sleep(self.poll_seconds)
+
+
+class CaseLookup(object):
+    """Enriched record by case number: LRU, then the record store, then a shared live scrape."""
+
+    def __init__(self, jac, record_store, out_dir_htm, max_items=1000, max_workers=8):
+        self.jac = jac
+        self.record_store = record_store
+        self.out_dir_htm = out_dir_htm
+        self.max_items = max_items
+        self.max_workers = max_workers
+        self.lru = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def get_cached(self, case_number):
+        with self.lock:
+            if case_number in self.lru:
+                self.lru.move_to_end(case_number)
+                return self.lru[case_number]
+        return None
+
+    def remember(self, case_number, record):
+        with self.lock:
+            self.lru[case_number] = record
+            self.lru.move_to_end(case_number)
+            while len(self.lru) > self.max_items:
+                self.lru.popitem(last=False)
+
+    def load(self, case_number):
+        record = self.record_store.get(case_number)
+        if record is None:
+            logging.info('lookup scraping: %s', case_number)
+            record = self.jac.lookup_case_number(case_number, self.out_dir_htm)
+            self.record_store.put(case_number, record)
+        return record
+
+    def get(self, case_number):
+        record = self.get_cached(case_number)
+        if record is not None:
+            return record
+        with self.lock:
+            waiter = self.in_flight.get(case_number)
+            owner = waiter is None
+            if owner:
+                waiter = {'event': threading.Event(), 'record': None, 'error': None}
+                self.in_flight[case_number] = waiter
+        if not owner:
+            waiter['event'].wait()
+            if waiter['error'] is not None:
+                raise waiter['error']
+            return waiter['record']
+        try:
+            waiter['record'] = self.load(case_number)
+            self.remember(case_number, waiter['record'])
+            return waiter['record']
+        except Exception as e:
+            waiter['error'] = e
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[case_number]
+            waiter['event'].set()
+
+    def get_many(self, case_numbers):
+        unique = list(OrderedDict.fromkeys(case_numbers))
+
+        def get_one(case_number):
+            try:
+                return case_number, {'record': self.get(case_number)}
+            except Exception as e:
+                return case_number, {'error': str(e)}
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(unique)))) as executor:
+            return OrderedDict(executor.map(get_one, unique))
@@ -0,0 +1,217 @@
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+from app import Jac, MyDate
+
+
+def generate_schedule(n, dates, cancelled_ratio=0.1, seed=0):
+    """A foreclosure_sales.html like the clerk's, with n cases spread over the given sale dates."""
+    rand = random.Random(seed)
+    first_names = ['JAMES', 'MARY', 'ROBERT', 'PATRICIA', 'JOHN', 'LINDA', 'MICHAEL', 'BARBARA']
+    last_names = ['SMITH', 'JOHNSON', 'WILLIAMS', 'BROWN', 'JONES', 'MILLER', 'DAVIS', 'WILSON']
+    banks = ['BANK NEW YORK', 'HSBC MORTGAGE', 'OCWEN LOAN SVC', 'WELLS FARGO BANK', 'NATIONSTAR MTG']
+    rows = []
+    for i in range(n):
+        case_number = '05-%d-CA-%06d-XXXX-XX' % (2008 + i % 10, i + 1)
+        title = '%s VS %s %s' % (rand.choice(banks), rand.choice(first_names), rand.choice(last_names))
+        comment = 'CANCELLED' if rand.random() < cancelled_ratio else '&nbsp;'
+        sale_date = dates[i * len(dates) // n].strftime('%m-%d-%Y')
+        css = 'oddrows' if i % 2 == 0 else 'evenrows'
+        rows.append('    <tr>\n' + ''.join('        <td class=%s>%s</td>\n' % (css, v)
+                                           for v in [case_number, title, comment, sale_date]) + '    </tr>\n')
+    return ('<html>\n<body>\n<table border=2 cellpadding=2 cellspacing=1>\n    <tr>\n'
+            '        <th>case_number</th>\n        <th>case_title</th>\n        <th>comment</th>\n'
+            '        <th>foreclosure_sale_date</th>\n    </tr>\n' + ''.join(rows) + '</table>\n</body>\n</html>\n')
+
+
+class FakeResponse(object):
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+
+class StubUpstreams(object):
+    """In-process stand-ins for every http infra class, answering from the test_resources responses."""
+
+    def __init__(self, resources_dir, schedule_html):
+        def read(name):
+            with open(os.path.join(resources_dir, name), 'rb') as handle:
+                return handle.read()
+
+        self.schedule = schedule_html.encode('utf-8')
+        self.beca = read('beca_case_resp.html')
+        self.public_records = read('public_records_resp.html')
+        self.bcpao_search = read('bcpao_resp.json')
+        self.bcpao_account = read('bcpao_resp2.json')
+        self.taxes = read('taxes_resp.html')
+
+    def get_items_resp_from_req(self, url):
+        return self.schedule
+
+    def get_case_info_resp_from_req(self, data_, headers_, url_):
+        return FakeResponse(self.beca)
+
+    def get_resp_from_request(self, request_info):
+        return self.public_records
+
+    def get_acct_by_legal_resp_from_req(self, url2, headers):
+        return FakeResponse(self.bcpao_search)
+
+    def get_res_from_req(self, req):
+        return FakeResponse(self.bcpao_account)
+
+    def get_resp_from_req(self, url):
+        return iter([self.taxes])
+
+
+class FixedTimeInfrastructure(object):
+    def __init__(self, today):
+        self.today = today
+
+    @staticmethod
+    def time():
+        return time.time()
+
+    @staticmethod
+    def time_strftime(fmt):
+        return time.strftime(fmt)
+
+    def get_today(self):
+        return self.today
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+def run_one(n, mode, resources_dir, stage_workers, latency):
+    from infra import FileSystemInfrastructure, ZipInfrastructure, ExcelFactory
+    today = date(2017, 5, 8)
+    dates = MyDate().get_next_dates(today)
+    schedule_html = generate_schedule(n, dates)
+    work_dir = tempfile.mkdtemp(prefix='jac_bench_')
+    resources_dir = os.path.abspath(resources_dir)
+    os.chdir(work_dir)
+    try:
+        if mode == 'replay':
+            jac = make_replay_jac(resources_dir, work_dir, schedule_html, latency)
+        else:
+            stub = StubUpstreams(resources_dir, schedule_html)
+            jac = Jac(None, stub, FileSystemInfrastructure(), stub, stub, stub, stub)
+        jac.file_system_infra = FileSystemInfrastructure()
+        jac.zip_infra = ZipInfrastructure()
+        jac.excel_infra = ExcelFactory()
+        jac.time_infra = FixedTimeInfrastructure(today)
+        jac.set_filter(lambda x: True)
+        jac.set_stage_workers(Jac.parse_stage_workers(stage_workers))
+
+        started = {}
+        latencies = []
+        render_seconds = []
+        lock = threading.Lock()
+        fill_beca, finish_case, render_workbook = jac.fill_beca, jac.finish_case, jac.render_workbook
+
+        def timed_fill_beca(job):
+            with lock:
+                started[job.r['case_number']] = time.time()
+            return fill_beca(job)
+
+        def timed_finish_case(job):
+            finish_case(job)
+            with lock:
+                latencies.append(time.time() - started[job.r['case_number']])
+
+        def timed_render_workbook(datasets, book, path):
+            render_start = time.time()
+            render_workbook(datasets, book, path)
+            render_seconds.append(time.time() - render_start)
+
+        jac.fill_beca, jac.finish_case, jac.render_workbook = timed_fill_beca, timed_finish_case, timed_render_workbook
+        run_start = time.time()
+        jac.go2(argparse.Namespace(zip=True, email=False, passw=None))
+        total = time.time() - run_start
+    finally:
+        os.chdir('/')
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {'n': n, 'mode': mode, 'enriched': len(latencies), 'seconds': round(total, 3),
+            'cases_per_sec': round(len(latencies) / total, 2) if total > 0 else None,
+            'p50': percentile(latencies, 50), 'p95': percentile(latencies, 95),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+            'render_seconds': round(sum(render_seconds), 3)}
+
+
+def make_replay_jac(resources_dir, work_dir, schedule_html, latency):
+    from infra import BclerkBecaInfrastructure, ForeclosuresInfrastructure, FileSystemInfrastructure, \
+        BclerkPublicRecordsInfrastructure, TaxesInfrastructure, BcpaoInfrastructure
+    from replay import ReplayHandler, ThreadingHTTPServer, configure_routes, get_routes, parse_per_route, Latency
+    replay_dir = os.path.join(work_dir, 'replay_resources')
+    shutil.copytree(resources_dir, replay_dir)
+    with open(os.path.join(replay_dir, 'foreclosures_resp.html'), 'w') as handle:
+        handle.write(schedule_html)
+    ReplayHandler.routes = configure_routes(get_routes(), replay_dir, parse_per_route(latency, Latency))
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), ReplayHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    Jac.configure_transport({}, upstream='http://127.0.0.1:%d' % httpd.server_address[1])
+    return Jac(None, ForeclosuresInfrastructure(), FileSystemInfrastructure(), BclerkBecaInfrastructure(),
+               BclerkPublicRecordsInfrastructure(), TaxesInfrastructure(), BcpaoInfrastructure())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='end-to-end go2 benchmark over synthetic schedules.')
+    parser.add_argument("--sizes", default='100,1000,10000', help="comma separated case counts to run.")
+    parser.add_argument("--mode", choices=['stub', 'replay'], default='stub',
+                        help="stub: in-process fake infra; replay: real infra against replay.py.")
+    parser.add_argument("--resources", default='test_resources', help="responses the fakes are built from.")
+    parser.add_argument("--stage-workers", default='beca=2,public_records=2,bcpao=4,taxes=4',
+                        help="worker threads per enrichment stage.")
+    parser.add_argument("--latency", action='append', help="replay latency spec(s), see replay.py.")
+    parser.add_argument("--one", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.one is not None:
+        logging.getLogger().setLevel(logging.WARNING)
+        result = run_one(args.one, args.mode, args.resources, args.stage_workers, args.latency)
+        print(json.dumps(result))
+        return 0
+
+    print('%8s %9s %10s %9s %9s %12s %10s' % ('cases', 'cases/s', 'p50 ms', 'p95 ms', 'rss MB', 'render s',
+                                               'total s'))
+    for n in [int(x) for x in args.sizes.split(',')]:
+        # one process per size so peak RSS is not carried over between sizes
+        cmd = [sys.executable, os.path.abspath(__file__), '--one', str(n), '--mode', args.mode,
+               '--resources', args.resources, '--stage-workers', args.stage_workers]
+        for spec in args.latency or []:
+            cmd.extend(['--latency', spec])
+        out = subprocess.check_output(cmd, universal_newlines=True)
+        r = json.loads(out.strip().splitlines()[-1])
+        print('%8d %9s %10.1f %9.1f %9.1f %12.3f %10.3f' % (r['n'], r['cases_per_sec'], (r['p50'] or 0) * 1000,
+                                                          (r['p95'] or 0) * 1000, r['peak_rss_mb'],
+                                                          r['render_seconds'], r['seconds']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
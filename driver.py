@@ -1,7 +1,7 @@
 import datetime
 import pprint
 
-from app import Foreclosures, MyDate, Jac
+from app import Foreclosures, MyDate, Jac, setup_logging
 from infra import ForeclosuresInfrastructure, BclerkBecaInfrastructure, BclerkPublicRecordsInfrastructure, \
     TaxesInfrastructure, BcpaoInfrastructure, FileSystemInfrastructure
 
@@ -35,6 +35,8 @@ class JacDriver(object):
         pprint.pprint(self.mrs[i])
 
 
-jd = JacDriver()
-jd.load_schedule()
-jd.get_scheduled_num()
+if __name__ == '__main__':
+    setup_logging()
+    jd = JacDriver()
+    jd.load_schedule()
+    jd.get_scheduled_num()
@@ -1,59 +1,450 @@
+import atexit
+import csv
 import email
+import hashlib
+import io
+import json
+import locale
+import mmap
 import os
+import re
 import shutil
 import smtplib
+import threading
 import time
 import zipfile
 from collections import OrderedDict
-from datetime import date
+from datetime import date, datetime
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import COMMASPACE, formatdate
 
-import requests
-from robobrowser import RoboBrowser
-from xlwt import Workbook
+import transport
 
 
-class ForeclosuresInfrastructure(object):
+def new_session():
+    replay = get_replay_archive()
+    if replay is not None:
+        import requests
+        s = requests.session()
+        adapter = replay.get_adapter()
+        s.mount('http://', adapter)
+        s.mount('https://', adapter)
+        return s
+    s = transport.new_session()
+    capture = get_capture_archive()
+    if capture is not None:
+        s.hooks['response'].append(capture.record)
+    return s
+
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def get_archive(kind, path, factory):
+    # opened once per path, so sessions created after a reconfiguration share the archive they are configured with
+    if not path:
+        return None
+    with _archives_lock:
+        if (kind, path) not in _archives:
+            _archives[(kind, path)] = factory(path)
+        return _archives[(kind, path)]
+
+
+def get_capture_archive():
+    def open_capture(path):
+        archive = CaptureArchive(path)
+        atexit.register(archive.close)
+        return archive
+
+    return get_archive('capture', transport.get_config().capture, open_capture)
+
+
+def get_replay_archive():
+    return get_archive('replay', transport.get_config().replay, ArchiveReplay)
+
+
+def get_body_bytes(body):
+    if body is None:
+        return b''
+    if isinstance(body, str):
+        return body.encode('utf-8')
+    return body
+
+
+class CaptureArchive(object):
+    """Upstream traffic as a zip of bodies and index.jsonl, kept in <path>.parts until close()."""
+    SKIPPED_HEADERS = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
+
+    def __init__(self, path):
+        self.path = path
+        # exchanges are written to <path>.parts as they happen and only packed into the zip by close(), so a
+        # process that is killed first still leaves a capture ArchiveReplay can read
+        self.parts_dir = self.get_parts_dir(path)
+        os.makedirs(os.path.join(self.parts_dir, 'bodies'), exist_ok=True)
+        os.makedirs(os.path.join(self.parts_dir, 'requests'), exist_ok=True)
+        self.index = open(os.path.join(self.parts_dir, 'index.jsonl'), 'w')
+        self.count = 0
+        self.started = time.time()
+        self.lock = threading.Lock()
+
     @staticmethod
-    def get_items_resp_from_req(url):
-        r = requests.get(url)
+    def get_parts_dir(path):
+        return path + '.parts'
+
+    def write_part(self, name, data):
+        FileSystemInfrastructure.save_content_to_file(os.path.join(self.parts_dir, name), 'wb', data)
+
+    def record(self, r, *args, **kwargs):
+        read_start = time.time()
+        content = r.content  # also reads streamed bodies in full; capture trades early termination for a full copy
+        read_seconds = time.time() - read_start
+        request_body = get_body_bytes(r.request.body)
+        with self.lock:
+            if self.index is None:
+                return r
+            self.count += 1
+            n = self.count
+            entry = {'n': n, 'method': r.request.method, 'url': r.request.url,
+                     'request_body_sha1': hashlib.sha1(request_body).hexdigest(), 'request_body': None,
+                     'status': r.status_code, 'reason': r.reason,
+                     'headers': dict((k, v) for k, v in r.headers.items() if k.lower() not in self.SKIPPED_HEADERS),
+                     'started': round(read_start - self.started - r.elapsed.total_seconds(), 6),
+                     'elapsed': r.elapsed.total_seconds(), 'read_seconds': round(read_seconds, 6),
+                     'body': 'bodies/%06d' % n, 'size': len(content)}
+            self.write_part(entry['body'], content)
+            if len(request_body) > 0:
+                entry['request_body'] = 'requests/%06d' % n
+                self.write_part(entry['request_body'], request_body)
+            # the index line goes last, so every line in it points at parts that are already complete
+            self.index.write(json.dumps(entry, sort_keys=True) + '\n')
+            self.index.flush()
+        return r
+
+    def close(self):
+        with self.lock:
+            if self.index is None:
+                return
+            self.index.close()
+            self.index = None
+            with zipfile.ZipFile(self.path, 'w', zipfile.ZIP_DEFLATED) as azip:
+                for root, the_dirs, files in os.walk(self.parts_dir):
+                    for f in sorted(files):
+                        path = os.path.join(root, f)
+                        azip.write(path, os.path.relpath(path, self.parts_dir).replace(os.sep, '/'))
+            shutil.rmtree(self.parts_dir)
+
+
+class ArchiveReplay(object):
+    """Answers requests from a CaptureArchive by method, url and request body."""
+
+    def __init__(self, path):
+        self.zip = None
+        self.parts_dir = None
+        if os.path.exists(path):
+            self.zip = zipfile.ZipFile(path)
+        else:
+            self.parts_dir = CaptureArchive.get_parts_dir(path)
+        self.by_body = {}
+        self.by_url = {}
+        self.served = {}
+        self.lock = threading.Lock()
+        for line in self.read('index.jsonl').decode('utf-8').splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break  # the last line of a capture that was killed mid-write
+            self.by_body.setdefault((entry['method'], entry['url'], entry['request_body_sha1']), []).append(entry)
+            self.by_url.setdefault((entry['method'], entry['url']), []).append(entry)
+
+    def read(self, name):
+        if self.zip is not None:
+            return self.zip.read(name)
+        with open(os.path.join(self.parts_dir, name), 'rb') as handle:
+            return handle.read()
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
+
+    def get_entries(self):
+        return [e for entries in self.by_url.values() for e in entries]
+
+    def find(self, method, url, body):
+        key = (method, url, hashlib.sha1(get_body_bytes(body)).hexdigest())
+        entries = self.by_body.get(key)
+        if entries is None:
+            key = (method, url)
+            entries = self.by_url.get(key)
+        if entries is None:
+            return None, None
+        with self.lock:
+            served = self.served.get(key, 0)
+            self.served[key] = served + 1
+            entry = entries[served % len(entries)]
+            return entry, self.read(entry['body'])
+
+    def get_adapter(self):
+        from requests.adapters import BaseAdapter
+        from requests.exceptions import ConnectionError
+        from requests.models import Response
+        from requests.structures import CaseInsensitiveDict
+        from requests.utils import get_encoding_from_headers
+        archive = self
+
+        class ArchiveReplayAdapter(BaseAdapter):
+            def send(self, request, **kwargs):
+                entry, body = archive.find(request.method, request.url, request.body)
+                if entry is None:
+                    raise ConnectionError('not in the capture archive: ' + request.method + ' ' + request.url,
+                                          request=request)
+                resp = Response()
+                resp.status_code = entry['status']
+                resp.reason = entry['reason']
+                resp.headers = CaseInsensitiveDict(entry['headers'])
+                resp.encoding = get_encoding_from_headers(resp.headers)
+                resp.raw = io.BytesIO(body)
+                resp.url = request.url
+                resp.request = request
+                return resp
+
+            def close(self):
+                pass
+
+        return ArchiveReplayAdapter()
+
+
+class SessionInfrastructure(object):
+    def __init__(self):
+        self._s = None
+        self._s_lock = threading.Lock()
+
+    @property
+    def s(self):
+        if self._s is None:
+            with self._s_lock:
+                if self._s is None:
+                    self._s = self.create_session()
+        return self._s
+
+    def create_session(self):
+        return new_session()
+
+
+class ForeclosuresInfrastructure(SessionInfrastructure):
+    def get_items_resp_from_req(self, url):
+        r = self.s.get(url)
         content = r.content
         return content
 
 
+class BlobStore(object):
+    """Files stored once under their sha256 and hardlinked into run directories."""
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    def get_path(self, digest):
+        return os.path.join(self.root_dir, digest[:2], digest)
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.get_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            FileSystemInfrastructure.write_atomically(
+                path, lambda temp_path: FileSystemInfrastructure.save_content_to_file(temp_path, 'wb', data))
+        return digest
+
+    def link(self, digest, file_path):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        try:
+            os.link(self.get_path(digest), file_path)
+        except OSError:
+            # no hardlinks across devices (or on this filesystem): fall back to a copy
+            shutil.copyfile(self.get_path(digest), file_path)
+
+    def save(self, file_path, data):
+        digest = self.put(data)
+        self.link(digest, file_path)
+        return digest
+
+
 class FileSystemInfrastructure(object):
+    def __init__(self, blob_store=None):
+        self.blob_store = blob_store
+
     @staticmethod
     def save_content_to_file(file_path, open_mode, r_text):
         with open(file_path, open_mode) as handle:
             handle.write(r_text)
 
     @staticmethod
-    def save_lines_to_file(file_path, open_mode, content_):
+    def write_atomically(file_path, write):
+        # write(temp_path) then a rename, so readers see the old file or the new one, never a partial write
+        temp_path = file_path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+        try:
+            write(temp_path)
+            os.replace(temp_path, file_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    @staticmethod
+    def rewrite_case_info_links(content_txt):
+        content_txt = content_txt.replace('href="css/', 'href="https://vmatrix1.brevardclerk.us/beca/css/')
+        content_txt = content_txt.replace('src="images/', 'src="https://vmatrix1.brevardclerk.us/beca/images/')
+        content_txt = content_txt.replace("newPopup('Vor_Request",
+                                          "newPopup('https://vmatrix1.brevardclerk.us/beca/Vor_Request")
+        return content_txt
+
+    @staticmethod
+    def restore_case_info_links(content_txt):
+        return content_txt.replace("newPopup('https://vmatrix1.brevardclerk.us/beca/Vor_Request",
+                                   "newPopup('Vor_Request")
+
+    def load_case_info(self, file_path):
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, 'r') as handle:
+            return self.restore_case_info_links(handle.read())
+
+    def save_lines_to_file(self, file_path, open_mode, content_):
+        if self.blob_store is not None and 'b' in open_mode:
+            # same decoding and newline handling as the temp-file round trip below
+            content_txt = io.TextIOWrapper(io.BytesIO(b''.join(content_))).read()
+            content_txt = self.rewrite_case_info_links(content_txt).replace('\n', os.linesep)
+            self.blob_store.save(file_path, content_txt.encode(locale.getpreferredencoding(False)))
+            return
         with open(file_path + 'temp', open_mode) as handle:
             for bl in content_:
                 handle.write(bl)
         with open(file_path + 'temp', 'r') as myfile:
-            content_txt = myfile.read()
-            content_txt = content_txt.replace('href="css/', 'href="https://vmatrix1.brevardclerk.us/beca/css/')
-            content_txt = content_txt.replace('src="images/', 'src="https://vmatrix1.brevardclerk.us/beca/images/')
-            content_txt = content_txt.replace("newPopup('Vor_Request",
-                                              "newPopup('https://vmatrix1.brevardclerk.us/beca/Vor_Request")
-            with open(file_path, 'w') as handle:
-                handle.write(content_txt)
+            content_txt = self.rewrite_case_info_links(myfile.read())
+        # replaced rather than rewritten in place: file_path may be a hardlink into a blob store shared by other runs
+        self.write_atomically(file_path, lambda temp_path: self.save_content_to_file(temp_path, 'w', content_txt))
         os.remove(file_path + 'temp')
 
     @staticmethod
     def do_mkdirs(out_dir):
         os.makedirs(out_dir)
 
+    @staticmethod
+    def save_json(file_path, obj):
+        parent = os.path.dirname(file_path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+
+        def write(temp_path):
+            with open(temp_path, 'w') as handle:
+                json.dump(obj, handle, default=CaseRecordStore.encode, sort_keys=True)
+
+        FileSystemInfrastructure.write_atomically(file_path, write)
+
+    @staticmethod
+    def save_book(book, file_path):
+        FileSystemInfrastructure.write_atomically(file_path, book.save)
+
+    @staticmethod
+    def remove_file(file_path):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+    @staticmethod
+    def load_json(file_path):
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, 'r') as handle:
+            return json.load(handle, object_hook=CaseRecordStore.decode)
+
+
+class CaseRecordStore(object):
+    """Enriched case records as one json file per case number, written atomically."""
+    # Item.pre_cache2's format (05-2008-CA-006267-XXXX-XX), anchored and without path characters in any part
+    CASE_NUMBER_RE = re.compile('\\d{2}-\\d{4}-[A-Za-z0-9]{2}-\\d{6}(-[A-Za-z0-9]+)*\\Z')
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    @classmethod
+    def is_valid_case_number(cls, case_number):
+        return isinstance(case_number, str) and cls.CASE_NUMBER_RE.match(case_number) is not None
+
+    def get_path(self, case_number):
+        if not self.is_valid_case_number(case_number):
+            raise ValueError('not a case number: %r' % (case_number,))
+        return os.path.join(self.root_dir, case_number + '.json')
+
+    @staticmethod
+    def encode(o):
+        if isinstance(o, datetime):
+            return {'__datetime__': o.isoformat()}
+        if isinstance(o, date):
+            return {'__date__': o.isoformat()}
+        if isinstance(o, set):
+            return sorted(o)
+        raise TypeError(repr(o) + ' is not JSON serializable')
+
+    @staticmethod
+    def decode(d):
+        if '__datetime__' in d:
+            return datetime.strptime(d['__datetime__'], '%Y-%m-%dT%H:%M:%S.%f' if '.' in d['__datetime__']
+                                     else '%Y-%m-%dT%H:%M:%S')
+        if '__date__' in d:
+            return datetime.strptime(d['__date__'], '%Y-%m-%d').date()
+        return d
+
+    def get(self, case_number):
+        return FileSystemInfrastructure.load_json(self.get_path(case_number))
+
+    def put(self, case_number, record):
+        FileSystemInfrastructure.save_json(self.get_path(case_number), record)
+
+
+class BackfillQueue(object):
+    """Failed enrichment stages waiting to be retried, one per (case number, stage)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        entries = FileSystemInfrastructure.load_json(self.path)
+        return entries if entries is not None else []
+
+    def save(self, entries):
+        FileSystemInfrastructure.save_json(self.path, entries)
+
+    def get_entries(self):
+        with self.lock:
+            return self.load()
+
+    def add(self, entry):
+        # a replaced entry's attempts and first queued time carry over, so it still ages out
+        key = (entry['case_number'], entry['stage'])
+        with self.lock:
+            loaded = self.load()
+            for x in loaded:
+                if (x['case_number'], x['stage']) == key:
+                    entry = dict(entry, attempts=max(x['attempts'], entry['attempts']),
+                                 queued_time=x.get('queued_time', x['time']))
+            entries = [x for x in loaded if (x['case_number'], x['stage']) != key]
+            entries.append(entry)
+            self.save(entries)
+
+    def remove(self, case_number, stage):
+        with self.lock:
+            self.save([x for x in self.load() if (x['case_number'], x['stage']) != (case_number, stage)])
+
 
 class BclerkPublicRecordsInfrastructure(object):
     @staticmethod
     def get_resp_from_request(request_info):
-        browser = RoboBrowser(history=True, parser='html.parser')
+        from robobrowser import RoboBrowser
+        browser = RoboBrowser(session=new_session(), history=True, parser='html.parser')
         browser.open(request_info['uri'])
         form = browser.get_forms()[0]
         for k, v in request_info['form'].items():
@@ -65,39 +456,148 @@ class BclerkPublicRecordsInfrastructure(object):
         return resp_text
 
 
-class BclerkBecaInfrastructure(object):
-    def __init__(self):
-        self.s = requests.session()
+class BclerkBecaInfrastructure(SessionInfrastructure):
+    def create_session(self):
+        s = new_session()
         data = OrderedDict()
         data['RadioChk'] = 'Yes'
         data['Submit'] = 'Submit'
-        self.s.post('https://vmatrix1.brevardclerk.us/beca/StartSearch.cfm', data)
+        s.post('https://vmatrix1.brevardclerk.us/beca/StartSearch.cfm', data)
+        return s
 
     def get_case_info_resp_from_req(self, data_, headers_, url_):
-        r = self.s.post(url_, data_, headers_, timeout=100)
+        r = self.s.post(url_, data_, headers_)
         return r
 
 
-class BcpaoInfrastructure(object):
-    def __init__(self):
-        self.s = requests.session()
-
+class BcpaoInfrastructure(SessionInfrastructure):
     def get_res_from_req(self, req):
-        ret = self.s.get(req['url'], headers=req['headers'], timeout=10)
+        ret = self.s.get(req['url'], headers=req['headers'])
         return ret
 
     def get_acct_by_legal_resp_from_req(self, url2, headers):
-        ret = self.s.get(url2, headers=headers, timeout=10)  # timeout in seconds
+        ret = self.s.get(url2, headers=headers)
         return ret
 
 
-class TaxesInfrastructure(object):
-    def __init__(self):
-        self.s = requests.session()
-
+class TaxesInfrastructure(SessionInfrastructure):
     def get_resp_from_req(self, url):
-        r = self.s.post(url, data='', headers='', stream=True, timeout=10)
-        return r.content
+        r = self.s.post(url, data='', headers='', stream=True)
+        return self.iter_chunks(r)
+
+    @staticmethod
+    def iter_chunks(r, chunk_size=8192):
+        # the caller may stop early; closing drops the rest of the body instead of downloading it
+        try:
+            for chunk in r.iter_content(chunk_size):
+                yield chunk
+        finally:
+            r.close()
+
+
+class TaxRollIndex(object):
+    """Account -> byte range index over the memory-mapped bulk tax-roll file; load() picks up appends."""
+
+    def __init__(self):
+        self.path = None
+        self.account_column = None
+        self.amount_column = None
+        self.delimiter = ','
+        self.header = None
+        self.offsets = {}
+        self.indexed_to = 0
+        self.tail_account = None
+        self.inode = None
+        self.mtime = None
+        self.mm = None
+        self.lock = threading.Lock()
+
+    def open(self, path, account_column='account', amount_column='amount_due', delimiter=','):
+        self.path = path
+        self.account_column = account_column
+        self.amount_column = amount_column
+        self.delimiter = delimiter
+        self.load()
+
+    def is_open(self):
+        return self.path is not None
+
+    def parse_line(self, line):
+        return next(csv.reader([line.decode('utf-8', 'replace').rstrip('\r\n')], delimiter=self.delimiter))
+
+    def load(self, batch_rows=100000):
+        with self.lock:
+            st = os.stat(self.path)
+            if st.st_ino != self.inode or st.st_size < self.indexed_to:
+                self.header = None
+                self.offsets = {}
+                self.indexed_to = 0
+                self.tail_account = None
+            self.inode = st.st_ino
+            self.mtime = st.st_mtime
+            if self.mm is not None:
+                self.mm.close()
+                self.mm = None
+            if st.st_size == 0:
+                return 0
+            with open(self.path, 'rb') as handle:
+                self.mm = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            added = 0
+            while True:
+                batch = self.index_rows(batch_rows)
+                added += batch
+                if batch < batch_rows:
+                    break
+            return added
+
+    def index_rows(self, max_rows):
+        mm = self.mm
+        rows = 0
+        account_index = None if self.header is None else self.header.index(self.account_column)
+        if self.tail_account is not None:
+            self.offsets.pop(self.tail_account, None)
+            self.tail_account = None
+        while rows < max_rows:
+            end = mm.find(b'\n', self.indexed_to)
+            if end == -1:
+                # a last line without a newline is indexed but not consumed, so the next load() redoes it in case
+                # it was still being appended
+                if self.header is not None and self.indexed_to < len(mm):
+                    self.tail_account = self.index_row(self.indexed_to, len(mm), account_index)
+                break
+            start = self.indexed_to
+            self.indexed_to = end + 1
+            if self.header is None:
+                self.header = self.parse_line(mm[start:end])
+                account_index = self.header.index(self.account_column)
+                continue
+            if self.index_row(start, end, account_index) is not None:
+                rows += 1
+        return rows
+
+    def index_row(self, start, end, account_index):
+        row = self.parse_line(self.mm[start:end])
+        if len(row) > account_index:
+            account = row[account_index].strip()
+            self.offsets[account] = (start, end)
+            return account
+        return None
+
+    def get(self, account):
+        with self.lock:
+            offsets = self.offsets.get(account.strip())
+            if offsets is None:
+                return None
+            row = self.parse_line(self.mm[offsets[0]:offsets[1]])
+        return dict(zip(self.header, row))
+
+    def get_amount(self, account):
+        row = self.get(account)
+        if row is not None:
+            return row.get(self.amount_column)
+
+    def age(self):
+        return time.time() - self.mtime
 
 
 class EmailInfrastructure(object):
@@ -129,12 +629,25 @@ class EmailInfrastructure(object):
 
 
 class ZipInfrastructure(object):
-    @staticmethod
-    def do_zip(out_dir, parent_out_dir, run_tag):
+    # a run's own state (for --resume, --rebuild and backfill), never sent to recipients
+    INTERNAL_DIRS = ['checkpoints']
+    INTERNAL_FILES = ['manifest.json', 'progress.json', 'email_body.htm']
+
+    @classmethod
+    def get_deliverable_paths(cls, out_dir):
+        ret = []
+        for root, the_dirs, files in os.walk(out_dir):
+            the_dirs[:] = sorted(x for x in the_dirs if x not in cls.INTERNAL_DIRS)
+            for f in sorted(files):
+                if f.endswith('.zip') or (root == out_dir and f in cls.INTERNAL_FILES):
+                    continue
+                ret.append(os.path.join(root, f))
+        return ret
+
+    def do_zip(self, out_dir, parent_out_dir, run_tag):
         def zipdir(path, azip):
-            for root, the_dirs, files in os.walk(path):
-                for f in files:
-                    azip.write(os.path.join(root, f))
+            for file_path in self.get_deliverable_paths(path):
+                azip.write(file_path)
 
         zip_filename = run_tag + '.zip'
         zip_filepath = parent_out_dir + '/' + zip_filename
@@ -144,6 +657,31 @@ class ZipInfrastructure(object):
         shutil.move(zip_filepath, final_zip_path)
         return final_zip_path
 
+    def get_file_digests(self, out_dir):
+        # relative path -> sha256 for what a recipient gets
+        ret = {}
+        for path in self.get_deliverable_paths(out_dir):
+            with open(path, 'rb') as handle:
+                ret[os.path.relpath(path, out_dir).replace(os.sep, '/')] = hashlib.sha256(handle.read()).hexdigest()
+        return ret
+
+    def do_delta_zip(self, out_dir, parent_out_dir, run_tag, delivered_files, delivered_run_tag):
+        # only new or changed files, plus delta_manifest.json listing the full set
+        files = self.get_file_digests(out_dir)
+        changed = sorted(k for k, v in files.items() if delivered_files.get(k) != v)
+        removed = sorted(k for k in delivered_files if k not in files)
+        manifest = {'run_tag': run_tag, 'base_run_tag': delivered_run_tag, 'files': files, 'changed': changed,
+                    'removed': removed}
+        zip_filename = run_tag + '-delta.zip'
+        zip_filepath = parent_out_dir + '/' + zip_filename
+        with zipfile.ZipFile(zip_filepath, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            for rel_path in changed:
+                zipf.write(os.path.join(out_dir, rel_path), rel_path)
+            zipf.writestr('delta_manifest.json', json.dumps(manifest, sort_keys=True, indent=1))
+        final_zip_path = out_dir + '/' + zip_filename
+        shutil.move(zip_filepath, final_zip_path)
+        return final_zip_path, files
+
 
 class TimeInfrastructure(object):
     @staticmethod
@@ -157,7 +695,16 @@ class TimeInfrastructure(object):
     def get_today(self):
         return date.today()
 
+    @staticmethod
+    def now():
+        return datetime.now()
+
+    @staticmethod
+    def sleep(seconds):
+        time.sleep(seconds)
+
 
 class ExcelFactory(object):
     def get_a_book(self):
+        from xlwt import Workbook
         return Workbook()
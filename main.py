@@ -2,14 +2,17 @@ import sys
 
 from app import Jac
 from infra import BclerkBecaInfrastructure, ForeclosuresInfrastructure, EmailInfrastructure, ZipInfrastructure, \
-    TimeInfrastructure, ExcelFactory
-from infra import FileSystemInfrastructure, BclerkPublicRecordsInfrastructure, BcpaoInfrastructure, TaxesInfrastructure
+    TimeInfrastructure, ExcelFactory, TaxRollIndex, CaseRecordStore, BackfillQueue
+from infra import FileSystemInfrastructure, BclerkPublicRecordsInfrastructure, BcpaoInfrastructure, TaxesInfrastructure, \
+    BlobStore
 
 
 def main():
-    jac = Jac(EmailInfrastructure(), ForeclosuresInfrastructure(), FileSystemInfrastructure(),
-              BclerkBecaInfrastructure(), BclerkPublicRecordsInfrastructure(), TaxesInfrastructure(),
-              BcpaoInfrastructure(), ZipInfrastructure(), TimeInfrastructure(), ExcelFactory())
+    file_system_infra = FileSystemInfrastructure(BlobStore('outputs/blobs'))
+    jac = Jac(EmailInfrastructure(), ForeclosuresInfrastructure(), file_system_infra, BclerkBecaInfrastructure(),
+              BclerkPublicRecordsInfrastructure(), TaxesInfrastructure(), BcpaoInfrastructure(), ZipInfrastructure(),
+              TimeInfrastructure(), ExcelFactory(), TaxRollIndex(), CaseRecordStore('outputs/records'),
+              BackfillQueue('outputs/backfill.json'))
 
     def my_filter(arg0):
         # return arg0['count'] == 1
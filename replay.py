@@ -0,0 +1,189 @@
+import argparse
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """http.server.ThreadingHTTPServer, which only exists from python 3.7 on."""
+    daemon_threads = True
+
+
+class Latency(object):
+    """Latency in seconds from fixed:S, uniform:LO:HI, exp:MEAN or lognormal:MU:SIGMA."""
+
+    def __init__(self, spec):
+        parts = spec.split(':')
+        self.kind = parts[0]
+        self.params = [float(x) for x in parts[1:]]
+        expected = {'fixed': 1, 'uniform': 2, 'exp': 1, 'lognormal': 2}
+        if self.kind not in expected or len(self.params) != expected[self.kind]:
+            raise ValueError('bad latency spec: ' + spec)
+
+    def sample(self, rand=random):
+        if self.kind == 'fixed':
+            return self.params[0]
+        if self.kind == 'uniform':
+            return rand.uniform(self.params[0], self.params[1])
+        if self.kind == 'exp':
+            return rand.expovariate(1.0 / self.params[0]) if self.params[0] > 0 else 0.0
+        return rand.lognormvariate(self.params[0], self.params[1])
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class Route(object):
+    def __init__(self, name, host, path_pattern, resource, content_type):
+        self.name = name
+        self.host = host
+        self.path_re = re.compile(path_pattern)
+        self.resource = resource
+        self.content_type = content_type
+        self.body = None
+        self.latency = None
+        self.bucket = None
+        self.error_rate = 0.0
+
+    def matches(self, host, path):
+        return host == self.host and self.path_re.match(path) is not None
+
+
+def get_routes():
+    return [Route('schedule', 'vweb2.brevardclerk.us', '/Foreclosures/foreclosure_sales.html',
+                  'foreclosures_resp.html', 'text/html'),
+            Route('beca_start', 'vmatrix1.brevardclerk.us', '/beca/StartSearch.cfm', None, 'text/html'),
+            Route('beca', 'vmatrix1.brevardclerk.us', '/beca/CaseNumber_Display.cfm', 'beca_case_resp.html',
+                  'text/html'),
+            Route('oncoreweb', 'web1.brevardclerk.us', '/oncoreweb/search.aspx', 'public_records_resp.html',
+                  'text/html'),
+            Route('bcpao_search', 'www.bcpao.us', '/api/v1/search', 'bcpao_resp.json', 'application/json'),
+            Route('bcpao_account', 'www.bcpao.us', '/api/v1/account/', 'bcpao_resp2.json', 'application/json'),
+            Route('taxes', 'brevard.county-taxes.com', '/public/real_estate/parcels/', 'taxes_resp.html',
+                  'text/html')]
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """Serves canned upstream responses for paths of the form /<original host>/<original path>."""
+    protocol_version = 'HTTP/1.1'
+    routes = []
+
+    def find_route(self):
+        path = urllib.parse.urlparse(self.path).path
+        host, _, rest = path.lstrip('/').partition('/')
+        for route in self.routes:
+            if route.matches(host, '/' + rest):
+                return route
+        return None
+
+    def send_body(self, status, body, content_type='text/html'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_any(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if length:
+            self.rfile.read(length)
+        route = self.find_route()
+        if route is None:
+            return self.send_body(404, b'no replay route')
+        if route.bucket is not None and not route.bucket.take():
+            return self.send_body(429, b'throttled')
+        if route.latency is not None:
+            time.sleep(route.latency.sample())
+        if route.error_rate and random.random() < route.error_rate:
+            return self.send_body(503, b'injected error')
+        return self.send_body(200, route.body, route.content_type)
+
+    def do_GET(self):
+        self.handle_any()
+
+    def do_POST(self):
+        self.handle_any()
+
+    def log_message(self, fmt, *args):
+        logging.debug('%s - %s', self.address_string(), fmt % args)
+
+
+def parse_per_route(values, convert):
+    # ['0.1', 'bcpao_search=0.5'] -> {None: convert('0.1'), 'bcpao_search': convert('0.5')}
+    ret = {}
+    for v in values or []:
+        name, sep, spec = v.partition('=')
+        if sep:
+            ret[name] = convert(spec)
+        else:
+            ret[None] = convert(v)
+    return ret
+
+
+def configure_routes(routes, resources_dir, latency=None, error_rate=None, rate=None):
+    latency = latency or {}
+    error_rate = error_rate or {}
+    rate = rate or {}
+    for route in routes:
+        if route.resource is None:
+            route.body = b'<html><body>ok</body></html>'
+        else:
+            with open(os.path.join(resources_dir, route.resource), 'rb') as handle:
+                route.body = handle.read()
+        route.latency = latency.get(route.name, latency.get(None))
+        route.error_rate = error_rate.get(route.name, error_rate.get(None, 0.0))
+        route_rate = rate.get(route.name, rate.get(None))
+        route.bucket = TokenBucket(route_rate) if route_rate else None
+    return routes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='stand-in for the county servers; run jac with '
+                                                 '--upstream http://127.0.0.1:<port> to use it.')
+    parser.add_argument("--host", default='127.0.0.1', help="address to listen on.")
+    parser.add_argument("--port", type=int, default=8013, help="port to listen on.")
+    parser.add_argument("--resources", default='test_resources', help="directory of captured responses.")
+    parser.add_argument("--latency", action='append',
+                        help="latency spec, optionally per route (e.g. taxes=lognormal:-1:0.5). repeatable.")
+    parser.add_argument("--error-rate", action='append', help="fraction answered with 503, optionally per route.")
+    parser.add_argument("--rate", action='append', help="requests/sec before answering 429, optionally per route.")
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s %(module)-15s %(levelname)s %(message)s', level=logging.INFO)
+
+    ReplayHandler.routes = configure_routes(get_routes(), args.resources, parse_per_route(args.latency, Latency),
+                                            parse_per_route(args.error_rate, float),
+                                            parse_per_route(args.rate, float))
+    httpd = ThreadingHTTPServer((args.host, args.port), ReplayHandler)
+    logging.info('replaying %s on http://%s:%s', args.resources, args.host, args.port)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+
+from app import Jac, CaseLookup, setup_logging
+from infra import BclerkBecaInfrastructure, ForeclosuresInfrastructure, FileSystemInfrastructure, \
+    BclerkPublicRecordsInfrastructure, TaxesInfrastructure, BcpaoInfrastructure, TimeInfrastructure, CaseRecordStore
+from replay import ThreadingHTTPServer
+
+
+class LookupHandler(BaseHTTPRequestHandler):
+    """GET /cases/<case_number> returns one enriched record; POST /cases with {"case_numbers": [...]} returns many."""
+    lookup = None
+
+    def send_json(self, status, obj):
+        body = json.dumps(obj, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urllib.parse.urlparse(self.path).path
+        if path == '/health':
+            return self.send_json(200, {'status': 'ok'})
+        if not path.startswith('/cases/'):
+            return self.send_json(404, {'error': 'not found'})
+        case_number = urllib.parse.unquote(path[len('/cases/'):])
+        if not CaseRecordStore.is_valid_case_number(case_number):
+            return self.send_json(404, {'error': 'not a case number'})
+        try:
+            return self.send_json(200, self.lookup.get(case_number))
+        except Exception as e:
+            logging.error('lookup failed for %s: %s', case_number, e)
+            return self.send_json(502, {'error': str(e)})
+
+    def do_POST(self):
+        if urllib.parse.urlparse(self.path).path != '/cases':
+            return self.send_json(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            case_numbers = json.loads(self.rfile.read(length).decode('utf-8'))['case_numbers']
+        except (ValueError, KeyError, TypeError):
+            return self.send_json(400, {'error': 'expected {"case_numbers": [...]}'})
+        if not isinstance(case_numbers, list):
+            return self.send_json(400, {'error': 'expected {"case_numbers": [...]}'})
+        invalid = [x for x in case_numbers if not CaseRecordStore.is_valid_case_number(x)]
+        if len(invalid) > 0:
+            return self.send_json(400, {'error': 'not case numbers', 'case_numbers': invalid})
+        return self.send_json(200, self.lookup.get_many(case_numbers))
+
+    def log_message(self, fmt, *args):
+        logging.info('%s - %s', self.address_string(), fmt % args)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default='127.0.0.1', help="address to listen on.")
+    parser.add_argument("--port", type=int, default=8012, help="port to listen on.")
+    parser.add_argument("--records-dir", default='outputs/records', help="on-disk enriched records.")
+    parser.add_argument("--lru-size", type=int, default=1000, help="records kept in memory.")
+    parser.add_argument("--log-level", default='DEBUG', help="root log level, e.g. INFO.")
+    args = parser.parse_args()
+    setup_logging(args.log_level)
+
+    jac = Jac(None, ForeclosuresInfrastructure(), FileSystemInfrastructure(), BclerkBecaInfrastructure(),
+              BclerkPublicRecordsInfrastructure(), TaxesInfrastructure(), BcpaoInfrastructure(),
+              time_infra=TimeInfrastructure())
+    out_dir_htm = 'outputs/lookups/html_files'
+    os.makedirs(out_dir_htm, exist_ok=True)
+    LookupHandler.lookup = CaseLookup(jac, CaseRecordStore(args.records_dir), out_dir_htm, max_items=args.lru_size)
+    httpd = ThreadingHTTPServer((args.host, args.port), LookupHandler)
+    logging.info('serving case lookups on http://%s:%s', args.host, args.port)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
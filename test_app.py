@@ -1,14 +1,27 @@
 import argparse
 import pprint
+import os
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
 from collections import OrderedDict
-from datetime import date
+from datetime import date, datetime
 from unittest.mock import MagicMock, call
 
 from xlwt import Formula
 
 from app import Foreclosures, MyDate, Jac, Taxes, Bcpao, BclerkPublicRecords, BclerkBeca, XlBuilder, FilterCancelled, \
-    FilterByDates, Item, Xl
+    FilterByDates, Item, Xl, EnrichmentCache, JacDaemon, CaseLookup, Pipeline, Stage, MemoryProfiler, \
+    ScheduleIndex, CaseJob, CircuitBreaker, LienSearch, setup_logging, stop_logging, \
+    log_case_event, SourceUnavailable, OnDates, DateRange, WithStatus, CaseType, CountWindow, DocketParseStore, \
+    CasePriority, ProgressiveWorkbook
+from infra import BclerkBecaInfrastructure, TaxRollIndex, CaptureArchive, ArchiveReplay, CaseRecordStore, \
+    BackfillQueue, FileSystemInfrastructure, BlobStore, ZipInfrastructure
+from replay import Latency, get_routes
+from transport import rewrite_url
+from bench import generate_schedule, percentile
 
 
 class MyTestCase(unittest.TestCase):
@@ -37,6 +50,11 @@ class MyTestCase(unittest.TestCase):
         ret = MyDate().get_next_dates(date(2017, 4, 23))
         self.assertEqual(ret, [date(2017, 4, 26), date(2017, 5, 3)])
 
+    def test_dates_weeks_num(self):
+        ret = MyDate(6).get_next_dates(date(2017, 4, 23))
+        self.assertEqual(ret, [date(2017, 4, 26), date(2017, 5, 3), date(2017, 5, 10), date(2017, 5, 17),
+                               date(2017, 5, 24), date(2017, 5, 31)])
+
     def test_get_short_date_strings_to_add(self):
         self.assertEqual(Jac().get_short_date_strings_to_add([date(2017, 4, 26), date(2017, 5, 3)]),
                          ['04.26.17', '05.03.17'])
@@ -50,7 +68,30 @@ class MyTestCase(unittest.TestCase):
             ret = Taxes(None).get_info_from_response('test_taxid', myfile.read())
             self.assertEqual(ret,
                              {'url_to_use': 'https://brevard.county-taxes.com/public/real_estate/parcels/test_taxid',
-                              'value_to_use': '859.99'})
+                              'value_to_use': '859.99',
+                              'bills': [{'year': '2016', 'status': '$859.99 due', 'unpaid': True},
+                                        {'year': '2015', 'status': 'Paid', 'unpaid': False},
+                                        {'year': '2014', 'status': 'Paid', 'unpaid': False},
+                                        {'year': '2013', 'status': 'Paid', 'unpaid': False},
+                                        {'year': '2005', 'status': 'Paid', 'unpaid': False}],
+                              'certificates_sold': 0})
+
+    def test_taxes_extract_stops_after_timeline(self):
+        with open('test_resources/taxes_resp.html', 'rb') as myfile:
+            content = myfile.read()
+        chunks = [content[i:i + 1000] for i in range(0, len(content), 1000)]
+        read = []
+
+        def stream():
+            for chunk in chunks:
+                read.append(chunk)
+                yield chunk
+
+        ret = Taxes.extract(stream())
+        self.assertEqual('859.99', ret['amount_unpaid'])
+        self.assertLess(len(read), len(chunks))
+        self.assertEqual(1, Taxes.extract(b'<ul class="timeline"><li><a>2015</a><div class="amount">'
+                                          b'<span>Certificate sold</span></div></li></ul>')['certificates_sold'])
 
     def test_bcpao_get_acct_by_legal(self):
         ret = Bcpao().get_acct_by_legal_request(
@@ -106,6 +147,14 @@ class MyTestCase(unittest.TestCase):
                  'subid': 'UH', 'pb': '53',
                  'legal_desc': 'LT 3 BLK A PB 53 PG 20 WYNDHAM AT DURAN S 09 T 26 R 36 SUBID UH', 'r': '36'}])
 
+    def test_public_records_grid_rows_projected(self):
+        with open('test_resources/public_records_resp.html', 'rb') as myfile:
+            rows = BclerkPublicRecords().get_grid_rows(myfile.read(), ['DocTypeKey', 'RecordDate', 'Book', 'Page'])
+        self.assertEqual(5, len(rows))
+        self.assertEqual({'DocTypeKey': 'LIS PENDENS', 'RecordDate': '6/6/2008', 'Book': '5868', 'Page': '9752'},
+                         rows[0])
+        self.assertEqual('APPEAL', rows[-1]['DocTypeKey'])
+
     def test_public_records_parse_records_grid_response2(self):
         # no legal desc is expected for this item
         with open('test_resources/public_records_resp2.html', 'rb') as myfile:
@@ -623,6 +672,7 @@ class MyTestCase(unittest.TestCase):
 
         sfi = StubFileInfra()
         sfi.do_mkdirs = MagicMock()
+        sfi.save_json = MagicMock()
 
         class StubTime(object):
             pass
@@ -676,6 +726,967 @@ class MyTestCase(unittest.TestCase):
         stub_xl.get_a_book.assert_called_once_with()
         mocked_book.save.assert_called_once_with('outputs/2017-05-13__19-54-16/11.23.16.xls')
 
+    def test_lazy_imports(self):
+        code = 'import sys, main; print(sorted(m for m in ("bs4", "xlwt", "requests", "robobrowser") if m in sys.modules))'
+        out = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True)
+        self.assertEqual('[]', out.strip())
+
+    def test_beca_infra_handshake_is_lazy(self):
+        infra = BclerkBecaInfrastructure()
+        self.assertIsNone(infra._s)
+
+    def test_enrichment_cache(self):
+        class StubTime(object):
+            pass
+
+        stub_time = StubTime()
+        stub_time.time = MagicMock(side_effect=[100, 150, 300])
+        cache = EnrichmentCache(stub_time, 60)
+        cache.put({'case_number': '05-2008-CA-033772-XXXX-XX', 'bcpao_acc': '2627712', 'count': 1}, [b'<html>'])
+        entry = cache.get({'case_number': '05-2008-CA-033772-XXXX-XX'})
+        self.assertEqual({'bcpao_acc': '2627712'}, entry['fields'])
+        self.assertEqual([b'<html>'], entry['content'])
+        self.assertIsNone(cache.get({'case_number': '05-2008-CA-033772-XXXX-XX'}))
+
+    def test_jac_get_dataset_uses_enrichment_cache(self):
+        class StubFileInfra(object):
+            pass
+
+        class StubTime(object):
+            pass
+
+        sfi = StubFileInfra()
+        sfi.save_lines_to_file = MagicMock()
+        stub_time = StubTime()
+        stub_time.time = MagicMock(return_value=0)
+        stub_time.time_strftime = MagicMock(return_value='05/13/2017')
+        cache = EnrichmentCache(stub_time, 60)
+        cache.put({'case_number': '05-2008-CA-033772-XXXX-XX', 'bcpao_acc': '2627712', 'legal': None, 'legals': [],
+                   'bcpao_item': {}}, [b'<html>'])
+        jac = Jac(None, None, sfi, None, None, None, None, None, stub_time, None)
+        jac.set_enrichment_cache(cache)
+        r = {'case_number': '05-2008-CA-033772-XXXX-XX', 'case_title': 'A VS B C', 'comment': '', 'count': 1,
+             'foreclosure_sale_date': date(2017, 5, 10)}
+        dataset = jac.get_dataset([r], 'out/05-10/html_files', '05-10')
+        self.assertEqual('2627712', r['bcpao_acc'])
+        self.assertEqual(2, len(dataset.get_items()))
+        sfi.save_lines_to_file.assert_called_once_with('out/05-10/html_files/2008_CA_033772_case_info.htm', 'wb',
+                                                       [b'<html>'])
+
+    def test_jac_reuse_stored_for_carried_over_dates(self):
+        class StubStore(object):
+            pass
+
+        class StubTime(object):
+            pass
+
+        stub_time = StubTime()
+        stub_time.time = MagicMock(return_value=1000)
+        store = StubStore()
+        stored = {'case_number': 'a', 'foreclosure_sale_date': date(2017, 5, 10), 'legal': {'subd': 'X'},
+                  'legals': [], 'bcpao_acc': '2627712', 'bcpao_item': {'address': '1 MAIN'}, 'enriched_time': 900}
+        store.get = MagicMock(side_effect=lambda cn: stored if cn == 'a' else None)
+        store.put = MagicMock()
+        jac = Jac(None, None, None, None, None, None, None, None, stub_time, None, None, store)
+        self.assertFalse(jac.reuse_stored({'case_number': 'a', 'foreclosure_sale_date': date(2017, 5, 10)}))
+        jac.reuse_max_age = 200
+        r = {'case_number': 'a', 'foreclosure_sale_date': date(2017, 5, 10)}
+        self.assertTrue(jac.reuse_stored(r))
+        self.assertEqual('2627712', r['bcpao_acc'])
+        self.assertFalse(jac.reuse_stored({'case_number': 'a', 'foreclosure_sale_date': date(2017, 5, 17)}))
+        self.assertFalse(jac.reuse_stored({'case_number': 'b', 'foreclosure_sale_date': date(2017, 5, 10)}))
+        jac.reuse_max_age = 50
+        self.assertFalse(jac.reuse_stored({'case_number': 'a', 'foreclosure_sale_date': date(2017, 5, 10)}))
+
+        jac.bcpr_infra = MagicMock()
+        jac.bcpao_infra = MagicMock()
+        job = CaseJob(r, '')
+        job.reused = True
+        jac.fill_public_records(job)
+        jac.fill_bcpao(job)
+        jac.finish_case(job)
+        self.assertEqual([], jac.bcpr_infra.mock_calls)
+        self.assertEqual([], jac.bcpao_infra.mock_calls)
+        self.assertEqual(900, store.put.call_args[0][1]['enriched_time'])
+
+    def test_circuit_breaker(self):
+        class StubTime(object):
+            pass
+
+        stub_time = StubTime()
+        stub_time.time = MagicMock(return_value=0)
+        breaker = CircuitBreaker('bcpao', stub_time, failures=2, reset_seconds=60)
+        failing = MagicMock(side_effect=IOError('down'))
+        self.assertRaises(IOError, breaker.call, failing)
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+        self.assertRaises(IOError, breaker.call, failing)
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+        self.assertRaises(SourceUnavailable, breaker.call, failing)
+        self.assertEqual(2, failing.call_count)
+
+        stub_time.time.return_value = 60
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())  # only one probe while half-open
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+        stub_time.time.return_value = 120
+        self.assertEqual('ok', breaker.call(lambda: 'ok'))
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+        self.assertEqual(1, breaker.trips)
+
+    def test_jac_breakers_mark_missing_sources(self):
+        class StubTime(object):
+            pass
+
+        stub_time = StubTime()
+        stub_time.time = MagicMock(return_value=0)
+        stub_time.time_strftime = MagicMock(return_value='05/13/2017')
+        jac = Jac(None, None, None, None, None, None, None, None, stub_time, None)
+        jac.set_circuit_breakers(1, 60)
+        jac.fill_beca = MagicMock()
+        jac.fill_public_records = MagicMock(side_effect=IOError('down'))
+        jac.fill_bcpao = MagicMock()
+        jac.fill_taxes = MagicMock()
+        jobs = [CaseJob({'case_number': '05-2008-CA-00000' + str(n) + '-XXXX-XX', 'count': n}, '') for n in [1, 2]]
+        jac.run_pipeline(jobs)
+        self.assertEqual({'public_records', 'bcpao', 'taxes'}, jobs[0].r['missing_sources'])
+        self.assertEqual({'public_records', 'bcpao', 'taxes'}, jobs[1].r['missing_sources'])
+        self.assertEqual(1, jac.fill_public_records.call_count)
+        self.assertEqual(2, jac.fill_beca.call_count)
+        jac.fill_bcpao.assert_not_called()
+
+        r = dict(jobs[0].r, comment='', case_title='A VS B', foreclosure_sale_date=date(2017, 5, 10))
+        row = []
+        XlBuilder('05-10', stub_time).add_to_row(row, r, 0)
+        displays = [x.get_display() for x in row]
+        self.assertEqual(6, displays.count(XlBuilder.MISSING))
+        self.assertIn('public_records (2 cases)', jac.get_missing_sources_str([jobs[0].r, jobs[1].r]))
+
+    def test_jac_beca_missing_skips_enrichment_cache(self):
+        class StubTime(object):
+            pass
+
+        stub_time = StubTime()
+        stub_time.time = MagicMock(return_value=0)
+        jac = Jac(None, None, None, None, None, None, None, None, stub_time, None)
+        jac.set_circuit_breakers(1, 60)
+        jac.set_enrichment_cache(EnrichmentCache(stub_time, 3600))
+        jac.fill_beca = MagicMock(side_effect=IOError('down'))
+        for name in ['fill_public_records', 'fill_bcpao', 'fill_taxes']:
+            setattr(jac, name, MagicMock())
+        jobs = [CaseJob({'case_number': '05-2008-CA-00000' + str(n) + '-XXXX-XX', 'count': n}, '') for n in [1, 2]]
+        jac.run_pipeline(jobs)
+        self.assertEqual({'beca'}, jobs[1].r['missing_sources'])
+        self.assertIsNone(jac.enrichment_cache.get(jobs[1].r))
+
+    def test_jac_backfill_failed_stages(self):
+        import requests
+
+        class StubTime(object):
+            pass
+
+        stub_time = StubTime()
+        stub_time.time = MagicMock(return_value=100)
+        stub_time.time_strftime = MagicMock(return_value='05/13/2017')
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = BackfillQueue(os.path.join(tmp, 'backfill.json'))
+            jac = Jac(None, None, FileSystemInfrastructure(), None, None, None, None, None, stub_time, MagicMock(),
+                      None, CaseRecordStore(os.path.join(tmp, 'records')), queue)
+            jac.fill_beca = MagicMock()
+            jac.fill_public_records = MagicMock()
+            jac.fill_bcpao = MagicMock(side_effect=requests.exceptions.Timeout('slow'))
+            jac.fill_taxes = MagicMock()
+            jac.render_workbook = MagicMock()
+            r = {'case_number': '05-2008-CA-000001-XXXX-XX', 'count': 1, 'comment': '', 'case_title': 'A VS B',
+                 'foreclosure_sale_date': date(2017, 5, 10)}
+            jac.write_run_manifest('05.10.17.xls', tmp, [{'dataset_title': '05-10', 'items': [r]}])
+            jac.run_dir = tmp
+            jac.run_pipeline([CaseJob(r, tmp + '/05-10/html_files')])
+            self.assertEqual([('05-2008-CA-000001-XXXX-XX', 'bcpao'), ('05-2008-CA-000001-XXXX-XX', 'taxes')],
+                             [(x['case_number'], x['stage']) for x in queue.get_entries()])
+            self.assertEqual(['bcpao', 'taxes'], jac.record_store.get(r['case_number'])['missing_sources'])
+            # as finish_case checkpoints a case whose stages an open breaker skipped
+            jac.save_checkpoint(CaseJob(jac.record_store.get(r['case_number']), None))
+
+            self.assertEqual(0, jac.backfill())
+            self.assertEqual([1, 1], [x['attempts'] for x in queue.get_entries()])
+
+            def fill_bcpao(job):
+                job.r['bcpao_acc'] = '2627712'
+                job.r['bcpao_item'] = {'address': '1 MAIN ST'}
+
+            jac.fill_bcpao = fill_bcpao
+            self.assertEqual(2, jac.backfill())
+            self.assertEqual([], queue.get_entries())
+            record = jac.record_store.get(r['case_number'])
+            self.assertNotIn('missing_sources', record)
+            self.assertEqual('2627712', record['bcpao_acc'])
+            self.assertEqual(date(2017, 5, 10), record['foreclosure_sale_date'])
+            datasets, _, path = jac.render_workbook.call_args[0]
+            self.assertEqual(tmp + '/05.10.17.xls', path)
+            self.assertEqual(2, len(datasets[0].get_items()))
+
+            # the run's checkpoint was patched too, so rebuilding the run keeps the backfilled fields
+            rebuilt = Jac(None, None, FileSystemInfrastructure(), None, None, None, None, None, stub_time, MagicMock())
+            rebuilt.render_workbook = MagicMock()
+            rebuilt.get_email_body = MagicMock(return_value='body')
+            self.assertEqual(0, rebuilt.rebuild(tmp))
+            mrs = rebuilt.get_email_body.call_args[0][3]
+            self.assertEqual('2627712', mrs[0]['bcpao_acc'])
+            self.assertNotIn('missing_sources', mrs[0])
+
+    def test_jac_backfill_gives_up_after_attempts_or_age(self):
+        class StubTime(object):
+            pass
+
+        stub_time = StubTime()
+        stub_time.time = MagicMock(return_value=100)
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = BackfillQueue(os.path.join(tmp, 'backfill.json'))
+            jac = Jac(None, None, FileSystemInfrastructure(), None, None, None, None, None, stub_time, MagicMock(),
+                      None, CaseRecordStore(os.path.join(tmp, 'records')), queue)
+            jac.set_backfill_limits(2, 86400)
+            jac.fill_taxes = MagicMock(side_effect=IOError('down'))
+            job = CaseJob({'case_number': '05-2008-CA-000001-XXXX-XX', 'count': 1, 'missing_sources': {'taxes'}}, '')
+            jac.store_record(job)
+            jac.queue_backfill(job)
+            jac.backfill()
+            jac.queue_backfill(job)  # failing again in a later run keeps the attempts and first queued time
+            self.assertEqual([(1, 100)], [(x['attempts'], x['queued_time']) for x in queue.get_entries()])
+            jac.backfill()
+            self.assertEqual([2], [x['attempts'] for x in queue.get_entries()])
+            jac.backfill()
+            self.assertEqual([], queue.get_entries())
+            self.assertEqual(2, jac.fill_taxes.call_count)  # not retried once given up
+
+            jac.set_backfill_limits(0, 86400)
+            jac.queue_backfill(job)
+            stub_time.time.return_value = 100 + 86401
+            jac.backfill()
+            self.assertEqual([], queue.get_entries())
+            self.assertEqual(2, jac.fill_taxes.call_count)
+
+    def test_jac_resume_skips_checkpointed_cases(self):
+        class StubTime(object):
+            pass
+
+        stub_time = StubTime()
+        stub_time.time = MagicMock(return_value=100)
+        stub_time.time_strftime = MagicMock(return_value='05/13/2017')
+        rows = [{'case_number': '05-2008-CA-00000' + str(n) + '-XXXX-XX', 'count': n, 'comment': '',
+                 'case_title': 'A VS B', 'foreclosure_sale_date': date(2017, 5, 10)} for n in [1, 2]]
+        with tempfile.TemporaryDirectory() as tmp:
+            run_dir = os.path.join(tmp, '2017-05-08__06-00-00')
+            jac = Jac(None, None, FileSystemInfrastructure(), None, None, None, None, None, stub_time, MagicMock())
+            jac.write_run_manifest('05.10.17.xls', run_dir, [{'dataset_title': '05-10', 'items': rows}], '05.10.17',
+                                   '{}')
+            jac.run_dir = run_dir
+            done = dict(rows[0], bcpao_acc='2627712', bcpao_item={'address': '1 MAIN ST'})
+            jac.finish_case(CaseJob(done, run_dir + '/05-10/html_files'))
+            os.makedirs(run_dir + '/05-10/html_files')
+
+            resumed = Jac(None, None, FileSystemInfrastructure(), None, None, None, None, None, stub_time,
+                          MagicMock())
+            for name in ['fill_beca', 'fill_public_records', 'fill_bcpao', 'fill_taxes', 'render_workbook']:
+                setattr(resumed, name, MagicMock())
+            resumed.fill_bcpao.side_effect = lambda job: job.r.update(bcpao_acc='2627713', bcpao_item={})
+            resumed.set_filter(lambda x: True)
+            self.assertEqual(0, resumed.go2(argparse.Namespace(zip=False, email=False, passw=None, resume=run_dir)))
+            self.assertEqual([rows[1]['case_number']], [x[0][0].r['case_number']
+                                                         for x in resumed.fill_beca.call_args_list])
+            datasets, _, path = resumed.render_workbook.call_args[0]
+            self.assertEqual(run_dir + '/05.10.17.xls', path)
+            self.assertEqual(3, len(datasets[0].get_items()))
+            self.assertTrue(os.path.exists(run_dir + '/checkpoints/' + rows[1]['case_number'] + '.json'))
+
+            # once the run is over (e.g. a daemon refreshing cases after a report), its checkpoints stay as delivered
+            self.assertIsNone(resumed.run_dir)
+            resumed.finish_case(CaseJob(dict(rows[1], bcpao_acc='9999999'), run_dir + '/05-10/html_files'))
+            checkpoint = FileSystemInfrastructure.load_json(run_dir + '/checkpoints/' + rows[1]['case_number'] + '.json')
+            self.assertEqual('2627713', checkpoint['bcpao_acc'])
+
+    def test_jac_rebuild_offline_from_saved_run(self):
+        import shutil
+
+        class StubTime(object):
+            pass
+
+        stub_time = StubTime()
+        stub_time.time = MagicMock(return_value=100)
+        stub_time.time_strftime = MagicMock(return_value='05/13/2017')
+        r = {'case_number': '05-2008-CA-006267-XXXX-XX', 'count': 1, 'comment': '', 'case_title': 'A VS B',
+             'foreclosure_sale_date': date(2017, 5, 10)}
+        with tempfile.TemporaryDirectory() as tmp:
+            run_dir = os.path.join(tmp, '2017-05-08__06-00-00')
+            fs = FileSystemInfrastructure()
+            jac = Jac(None, None, fs, None, None, None, None, None, stub_time, MagicMock())
+            jac.write_run_manifest('05.10.17.xls', run_dir, [{'dataset_title': '05-10', 'items': [r]}], '05.10.17',
+                                   '{}')
+            jac.run_dir = run_dir
+            jac.save_checkpoint(CaseJob(dict(r, bcpao_acc='2627712', bcpao_item={'address': '1 MAIN ST'},
+                                             latest_amount_due=None), None))
+            os.makedirs(run_dir + '/05-10/html_files')
+            shutil.copyfile('test_resources/beca_case_resp.html',
+                            run_dir + '/05-10/html_files/' + Item.get_id2_from_item(r) + '_case_info.htm')
+
+            parse = MagicMock(side_effect=BclerkBeca().parse_reg_actions_response)
+            for _ in range(2):
+                rebuilt = Jac(None, None, fs, None, None, None, None, MagicMock(), stub_time, MagicMock())
+                rebuilt.docket_store = DocketParseStore(fs, os.path.join(tmp, 'parsed'), parse)
+                rebuilt.render_workbook = MagicMock()
+                rebuilt.get_email_body = MagicMock(return_value='body')
+                self.assertEqual(0, rebuilt.rebuild(run_dir + '/', do_zip=True))
+            self.assertEqual(1, parse.call_count)
+            mrs = rebuilt.get_email_body.call_args[0][3]
+            self.assertEqual('2627712', mrs[0]['bcpao_acc'])
+            self.assertEqual('View On Request', mrs[0]['orig_mtg_link']['title'])
+            self.assertEqual('https://vmatrix1.brevardclerk.us/beca/Vor_Request.cfm?Brcd_id=22902619',
+                             mrs[0]['orig_mtg_link']['href'])
+            self.assertEqual('Viewable', mrs[0]['latest_amount_due']['title'])
+            self.assertEqual(run_dir + '/05.10.17.xls', rebuilt.render_workbook.call_args[0][2])
+            rebuilt.zip_infra.do_zip.assert_called_once_with(run_dir, tmp, '05.10.17')
+            with open(run_dir + '/email_body.htm') as handle:
+                self.assertEqual('body', handle.read())
+
+    def test_progressive_workbook(self):
+        from infra import ExcelFactory
+
+        class StubTime(object):
+            pass
+
+        stub_time = StubTime()
+        stub_time.time = MagicMock(return_value=100)
+        stub_time.time_strftime = MagicMock(return_value='05/13/2017')
+        rows = [{'case_number': '05-2008-CA-00000' + str(n) + '-XXXX-XX', 'count': n, 'comment': '',
+                 'case_title': 'A VS B', 'foreclosure_sale_date': date(2017, 5, 10 if n < 3 else 17),
+                 'bcpao_acc': '262771' + str(n), 'bcpao_item': {'address': str(n) + ' MAIN ST'}} for n in [1, 2, 3]]
+        with tempfile.TemporaryDirectory() as tmp:
+            fs = FileSystemInfrastructure()
+            progress = ProgressiveWorkbook(fs, ExcelFactory(), stub_time, every_cases=2, every_seconds=60)
+            progress.case_done(rows[0])  # not started, ignored
+            progress.start(tmp, '05.10.17.xls', [{'dataset_title': '05-10', 'items': rows[:2]},
+                                                 {'dataset_title': '05-17', 'items': rows[2:]}])
+            progress.case_done(rows[1])
+            self.assertTrue(progress.flush(5))
+            self.assertFalse(os.path.exists(tmp + '/05.10.17.partial.xls'))
+            stub_time.time.return_value = 200
+            progress.case_done(rows[2])
+            self.assertTrue(progress.flush(5))
+            self.assertTrue(os.path.exists(tmp + '/05.10.17.partial.xls'))
+            self.assertEqual((2, 3, False), tuple(fs.load_json(tmp + '/progress.json')[k]
+                                                  for k in ['done', 'total', 'complete']))
+            progress.case_done(rows[0])
+            progress.sheet_done(0, XlBuilder('05-10', stub_time).add_sheet(rows[:2]))
+            self.assertTrue(progress.flush(5))
+            written = fs.load_json(tmp + '/progress.json')
+            self.assertEqual([True, False], [x['complete'] for x in written['sheets']])
+            self.assertEqual(3, written['done'])
+
+            progress.finish()
+            self.assertFalse(os.path.exists(tmp + '/05.10.17.partial.xls'))
+            self.assertTrue(fs.load_json(tmp + '/progress.json')['complete'])
+            self.assertEqual([], [x for x in os.listdir(tmp) if x.endswith('.tmp')])
+
+            # a failing render is logged on the writer thread, never raised into the pipeline worker
+            broken_excel = MagicMock()
+            broken_excel.get_a_book = MagicMock(side_effect=OSError('disk full'))
+            broken = ProgressiveWorkbook(fs, broken_excel, stub_time, every_cases=1, every_seconds=0)
+            broken.start(tmp, '05.10.17.xls', [{'dataset_title': '05-10', 'items': rows}])
+            broken.case_done(rows[0])
+            self.assertTrue(broken.flush(5))
+            broken.finish()
+            self.assertTrue(fs.load_json(tmp + '/progress.json')['complete'])
+
+    def test_blob_store_links_identical_dockets(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fs = FileSystemInfrastructure(BlobStore(os.path.join(tmp, 'blobs')))
+            plain = FileSystemInfrastructure()
+            content = [b'<link href="css/a.css">', b'<img src="images/b.png">\r\n']
+            first, second, third = [os.path.join(tmp, x + '_case_info.htm') for x in ['run1', 'run2', 'plain']]
+            fs.save_lines_to_file(first, 'wb', content)
+            fs.save_lines_to_file(second, 'wb', content)
+            plain.save_lines_to_file(third, 'wb', content)
+            with open(first, 'rb') as a, open(third, 'rb') as b:
+                self.assertEqual(b.read(), a.read())
+            self.assertEqual(os.stat(first).st_ino, os.stat(second).st_ino)
+            self.assertEqual(1, sum(len(files) for _, _, files in os.walk(os.path.join(tmp, 'blobs'))))
+
+            # rewriting a linked docket without the blob store leaves the shared blob (and the other run) alone
+            plain.save_lines_to_file(first, 'wb', [b'changed'])
+            with open(first, 'rb') as a, open(second, 'rb') as b, open(third, 'rb') as c:
+                self.assertEqual(b'changed', a.read())
+                self.assertEqual(c.read(), b.read())
+            self.assertEqual([], [x for x in os.listdir(tmp) if x.endswith('.tmp') or x.endswith('temp')])
+
+    def test_delta_zip(self):
+        import json
+        import zipfile
+
+        def write(path, text):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as handle:
+                handle.write(text)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            run1, run2 = os.path.join(tmp, 'run1'), os.path.join(tmp, 'run2')
+            write(run1 + '/05-10/html_files/a_case_info.htm', 'a')
+            write(run1 + '/05-10/html_files/b_case_info.htm', 'b')
+            write(run1 + '/05.10.17.xls', 'book1')
+            write(run2 + '/05-10/html_files/a_case_info.htm', 'a')
+            write(run2 + '/05-17/html_files/c_case_info.htm', 'c')
+            write(run2 + '/05.10.17.xls', 'book2')
+            write(run2 + '/checkpoints/c.json', '{}')
+            write(run2 + '/manifest.json', '{}')
+            write(run2 + '/progress.json', '{}')
+            write(run2 + '/email_body.htm', 'body')  # written by --rebuild
+            write(run2 + '/05.17.17.zip', 'an earlier zip')
+            zip_infra = ZipInfrastructure()
+            _, delivered = zip_infra.do_delta_zip(run1, tmp, '05.10.17', {}, None)
+            path, files = zip_infra.do_delta_zip(run2, tmp, '05.17.17', delivered, '05.10.17')
+            self.assertEqual(run2 + '/05.17.17-delta.zip', path)
+            with zipfile.ZipFile(path) as z:
+                self.assertEqual(['05-17/html_files/c_case_info.htm', '05.10.17.xls', 'delta_manifest.json'],
+                                 sorted(z.namelist()))
+                manifest = json.loads(z.read('delta_manifest.json').decode())
+            self.assertEqual(['05-10/html_files/b_case_info.htm'], manifest['removed'])
+            self.assertEqual('05.10.17', manifest['base_run_tag'])
+            self.assertEqual(sorted(files), sorted(manifest['files']))
+            self.assertNotIn('checkpoints/c.json', files)
+
+            # a full zip leaves out the same internal files, and the zips already in the run
+            path = zip_infra.do_zip(run2, tmp, '05.17.17')
+            with zipfile.ZipFile(path) as z:
+                self.assertEqual(['05-10/html_files/a_case_info.htm', '05-17/html_files/c_case_info.htm',
+                                  '05.10.17.xls'], sorted(os.path.relpath('/' + x, run2) for x in z.namelist()))
+
+    def test_jac_delivered_only_after_email_sent(self):
+        jac = Jac(MagicMock(), None, MagicMock())
+        files = {'05.17.17.xls': 'abc'}
+        not_emailed = argparse.Namespace(email=False, passw=None)
+        self.assertFalse(jac.deliver(not_emailed, ['a.xls'], 's', 'b', 'outputs', '05.17.17', files))
+        jac.file_system_infra.save_json.assert_not_called()
+
+        emailed = argparse.Namespace(email=True, passw='secret')
+        jac.email_infra.send_mail = MagicMock(side_effect=OSError('smtp down'))
+        self.assertRaises(OSError, jac.deliver, emailed, ['a.xls'], 's', 'b', 'outputs', '05.17.17', files)
+        jac.file_system_infra.save_json.assert_not_called()
+
+        jac.email_infra.send_mail = MagicMock()
+        self.assertTrue(jac.deliver(emailed, ['a.xls'], 's', 'b', 'outputs', '05.17.17', files))
+        jac.file_system_infra.save_json.assert_called_once_with('outputs/delivered.json',
+                                                                {'run_tag': '05.17.17', 'files': files})
+
+    def test_lien_search_dedupes_names_and_caches(self):
+        class StubTime(object):
+            pass
+
+        stub_time = StubTime()
+        stub_time.time = MagicMock(return_value=0)
+        stub_time.time_strftime = MagicMock(return_value='05/13/2017')
+        with open('test_resources/public_records_resp.html', 'rb') as myfile:
+            resp_text = myfile.read()
+        bcpr_infra = MagicMock()
+        bcpr_infra.get_resp_from_request = MagicMock(return_value=resp_text)
+        search = LienSearch(bcpr_infra, stub_time, 60)
+        mrs = [{'case_title': 'BANK NEW YORK VS JAMES H WOOD'}, {'case_title': 'OCWEN LOAN SVC VS JAMES H WOOD'}]
+        search.fill(mrs)
+        self.assertEqual(2, bcpr_infra.get_resp_from_request.call_count)  # 'WOOD, JAMES H' and 'WOOD, JAMES'
+        self.assertEqual({'txtName': 'WOOD, JAMES H', 'SearchType': 'fullname', 'txtDocTypes': ''},
+                         bcpr_infra.get_resp_from_request.call_args_list[0][0][0]['form'])
+        self.assertEqual(1, mrs[0]['lien_docs'])  # JUDGMENT REAL PROPERTY, once across both combos
+        self.assertEqual(mrs[0]['lien_docs'], mrs[1]['lien_docs'])
+
+        search.fill([{'case_title': 'A VS JAMES H WOOD'}])
+        self.assertEqual(2, bcpr_infra.get_resp_from_request.call_count)
+
+        # saved names are reused by a later process until they expire
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_path = os.path.join(tmp, 'lien_cache.json')
+            LienSearch(bcpr_infra, stub_time, 60, 4, FileSystemInfrastructure(), cache_path).fill(mrs)
+            self.assertEqual(4, bcpr_infra.get_resp_from_request.call_count)
+            later = [{'case_title': 'A VS JAMES H WOOD'}]
+            LienSearch(bcpr_infra, stub_time, 60, 4, FileSystemInfrastructure(), cache_path).fill(later)
+            self.assertEqual(4, bcpr_infra.get_resp_from_request.call_count)
+            self.assertEqual(1, later[0]['lien_docs'])
+            stub_time.time.return_value = 61
+            LienSearch(bcpr_infra, stub_time, 60, 4, FileSystemInfrastructure(), cache_path).fill(later)
+            self.assertEqual(6, bcpr_infra.get_resp_from_request.call_count)
+
+        stub_time.time.return_value = 61
+        failing = [{'case_title': 'A VS JAMES H WOOD'}]
+        bcpr_infra.get_resp_from_request.side_effect = IOError('down')
+        search.fill(failing)
+        self.assertEqual({'liens'}, failing[0]['missing_sources'])
+
+        row = []
+        XlBuilder('05-10', stub_time, True).add_to_row(row, dict(mrs[0], case_number='05-2008-CA-000001-XXXX-XX',
+                                                                  comment='', count=1, bcpao_acc='1',
+                                                                  foreclosure_sale_date=date(2017, 5, 10)), 0)
+        headers = XlBuilder('a', None, True).get_headers
+        self.assertEqual(['lien_docs', 'lien_total'], [x.get_display() for x in headers][-2:])
+        self.assertEqual(mrs[0]['lien_docs'], row[-2].get_display())
+
+    def test_jac_saves_and_backfills_liens(self):
+        class StubTime(object):
+            pass
+
+        stub_time = StubTime()
+        stub_time.time = MagicMock(return_value=100)
+        stub_time.time_strftime = MagicMock(return_value='05/13/2017')
+        rows = [{'case_number': '05-2008-CA-00000' + str(n) + '-XXXX-XX', 'count': n, 'comment': '',
+                 'case_title': 'A VS B', 'foreclosure_sale_date': date(2017, 5, 10), 'bcpao_acc': '1'} for n in [1, 2]]
+        with tempfile.TemporaryDirectory() as tmp:
+            queue = BackfillQueue(os.path.join(tmp, 'backfill.json'))
+            jac = Jac(None, None, FileSystemInfrastructure(), None, None, None, None, None, stub_time, MagicMock(),
+                      None, CaseRecordStore(os.path.join(tmp, 'records')), queue)
+            for name in ['fill_beca', 'fill_public_records', 'fill_bcpao', 'fill_taxes']:
+                setattr(jac, name, MagicMock())
+            jac.run_dir = tmp
+
+            def fill(mrs):
+                for r in mrs:
+                    if r['count'] == 1:
+                        r.update(lien_docs=2, lien_total=150.0)
+                    else:
+                        r['missing_sources'] = {'liens'}
+
+            jac.lien_search = MagicMock()
+            jac.lien_search.fill = MagicMock(side_effect=fill)
+            jac.get_dataset(rows, tmp + '/05-10/html_files', '05-10')
+            self.assertEqual(2, jac.file_system_infra.load_json(jac.get_checkpoint_path(rows[0]))['lien_docs'])
+            self.assertEqual(150.0, jac.record_store.get(rows[0]['case_number'])['lien_total'])
+            self.assertEqual([(rows[1]['case_number'], 'liens')],
+                             [(x['case_number'], x['stage']) for x in queue.get_entries()])
+
+            # resuming: a checkpoint with lien results isn't searched again, one whose search failed is
+            resumed_rows = [dict((k, v) for k, v in x.items() if k not in ['lien_docs', 'lien_total',
+                                                                             'missing_sources']) for x in rows]
+            jac.get_dataset(resumed_rows, tmp + '/05-10/html_files', '05-10')
+            self.assertEqual([rows[1]['case_number']], [r['case_number'] for r in jac.lien_search.fill.call_args[0][0]])
+            self.assertEqual(2, resumed_rows[0]['lien_docs'])
+
+            jac.render_workbook = MagicMock()
+            jac.lien_search.fill = MagicMock(side_effect=lambda mrs: [r.update(lien_docs=0, lien_total=0,
+                                                                             missing_sources=set()) for r in mrs])
+            self.assertEqual(1, jac.backfill())
+            self.assertEqual([], queue.get_entries())
+            self.assertEqual(0, jac.record_store.get(rows[1]['case_number'])['lien_docs'])
+
+    def test_xl_hyperlink_formula_matches_parsed(self):
+        for url, text in [('http://web1.brevardclerk.us/oncoreweb/search.aspx?n=WOOD%2C+JAMES', 'WOOD, JAMES'),
+                          ('https://www.bcpao.us/PropertySearch', 'bcpao'), ('http://x/h\xe9', '\u4e2d')]:
+            fast = Xl.get_formula_hyperlink(url, text)
+            parsed = Formula('HYPERLINK("' + url + '";"' + text + '")')
+            self.assertEqual(parsed.rpn(), fast.rpn())
+            self.assertEqual(parsed.text(), fast.text())
+            self.assertIsInstance(fast, Formula)
+        self.assertIs(Xl().link_style, Xl().link_style)
+
+    def test_setup_logging_queue_and_json_events(self):
+        import io
+        import json
+        import logging
+        root = logging.getLogger()
+        saved_handlers, saved_level = root.handlers[:], root.level
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path = os.path.join(tmp, 'events.jsonl')
+            out = io.StringIO()
+            try:
+                setup_logging('info', '%(levelname)s %(message)s', json_path, out)
+                logging.debug('hidden %s', 1)
+                logging.info('shown %s', 2)
+                log_case_event('finished', {'case_number': '05-2008-CA-000001-XXXX-XX', 'count': 1}, missing=[])
+                stop_logging()
+            finally:
+                for handler in root.handlers[:]:
+                    root.removeHandler(handler)
+                for handler in saved_handlers:
+                    root.addHandler(handler)
+                root.setLevel(saved_level)
+            lines = out.getvalue().splitlines()
+            self.assertEqual('INFO shown 2', lines[0])
+            self.assertTrue(lines[1].startswith('INFO count_id: 1 finished'))
+            self.assertEqual(2, len(lines))
+            with open(json_path) as handle:
+                events = [json.loads(x) for x in handle]
+            self.assertEqual(1, len(events))
+            self.assertEqual('finished', events[0]['event'])
+            self.assertEqual('05-2008-CA-000001-XXXX-XX', events[0]['case_number'])
+            self.assertEqual([], events[0]['missing'])
+
+    def test_jac_daemon_is_report_due(self):
+        daemon = JacDaemon(Jac(), 60, 0, 6)
+        self.assertFalse(daemon.is_report_due(datetime(2017, 5, 15, 5, 59)))
+        self.assertTrue(daemon.is_report_due(datetime(2017, 5, 15, 6, 0)))
+        daemon.last_report_date = date(2017, 5, 15)
+        self.assertFalse(daemon.is_report_due(datetime(2017, 5, 15, 7, 0)))
+        self.assertFalse(daemon.is_report_due(datetime(2017, 5, 16, 7, 0)))
+
+    def test_write_atomically_keeps_old_file_on_failure(self):
+        def broken_write(temp_path):
+            FileSystemInfrastructure.save_content_to_file(temp_path, 'w', 'partial')
+            raise OSError('disk full')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = CaseRecordStore(os.path.join(tmp, 'records'))
+            store.put('05-2008-CA-006267-XXXX-XX', {'sale': date(2017, 5, 1)})
+            path = store.get_path('05-2008-CA-006267-XXXX-XX')
+            self.assertRaises(OSError, FileSystemInfrastructure.write_atomically, path, broken_write)
+            self.assertEqual(date(2017, 5, 1), store.get('05-2008-CA-006267-XXXX-XX')['sale'])
+            self.assertEqual(['05-2008-CA-006267-XXXX-XX.json'], os.listdir(os.path.join(tmp, 'records')))
+
+    def test_case_record_store_rejects_paths(self):
+        from server import LookupHandler
+        from replay import ThreadingHTTPServer
+        import urllib.request
+        import urllib.error
+        with tempfile.TemporaryDirectory() as tmp:
+            store = CaseRecordStore(tmp)
+            self.assertEqual(os.path.join(tmp, '05-2008-CA-006267-XXXX-XX.json'),
+                             store.get_path('05-2008-CA-006267-XXXX-XX'))
+            for bad in ['../x', '/etc/passwd', '05-2008-CA-006267-../../x', '05-2008-CA-006267\n', '']:
+                self.assertRaises(ValueError, store.get_path, bad)
+
+        class StubLookup(object):
+            pass
+
+        lookup = StubLookup()
+        lookup.get = MagicMock(return_value={'case_number': '05-2008-CA-006267-XXXX-XX'})
+        lookup.get_many = MagicMock()
+        handler = type('Handler', (LookupHandler,), {'lookup': lookup})
+        httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        base = 'http://127.0.0.1:%d' % httpd.server_address[1]
+        try:
+            with urllib.request.urlopen(base + '/cases/05-2008-CA-006267-XXXX-XX') as resp:
+                self.assertEqual(200, resp.status)
+            with self.assertRaises(urllib.error.HTTPError) as cm:
+                urllib.request.urlopen(base + '/cases/..%2F..%2Fetc%2Fpasswd')
+            self.assertEqual(404, cm.exception.code)
+            request = urllib.request.Request(base + '/cases', data=b'{"case_numbers": ["../x"]}')
+            with self.assertRaises(urllib.error.HTTPError) as cm:
+                urllib.request.urlopen(request)
+            self.assertEqual(400, cm.exception.code)
+            lookup.get.assert_called_once_with('05-2008-CA-006267-XXXX-XX')
+            self.assertEqual(0, lookup.get_many.call_count)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+    def test_case_lookup_lru_and_store(self):
+        class StubStore(object):
+            pass
+
+        store = StubStore()
+        store.get = MagicMock(side_effect=[None, {'case_number': 'b', 'stored': True}])
+        store.put = MagicMock()
+        jac = Jac()
+        jac.lookup_case_number = MagicMock(return_value={'case_number': 'a', 'bcpao_acc': '1'})
+        lookup = CaseLookup(jac, store, 'out', max_items=1)
+        self.assertEqual({'case_number': 'a', 'bcpao_acc': '1'}, lookup.get('a'))
+        self.assertEqual({'case_number': 'a', 'bcpao_acc': '1'}, lookup.get('a'))
+        jac.lookup_case_number.assert_called_once_with('a', 'out')
+        store.put.assert_called_once_with('a', {'case_number': 'a', 'bcpao_acc': '1'})
+        self.assertEqual({'record': {'case_number': 'b', 'stored': True}}, lookup.get_many(['b', 'b'])['b'])
+        self.assertEqual(['b'], list(lookup.lru))
+
+    def test_case_lookup_coalesces_concurrent_requests(self):
+        class StubStore(object):
+            pass
+
+        store = StubStore()
+        store.get = MagicMock(return_value=None)
+        store.put = MagicMock()
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_lookup(case_number, out_dir_htm):
+            started.set()
+            release.wait(5)
+            return {'case_number': case_number}
+
+        jac = Jac()
+        jac.lookup_case_number = MagicMock(side_effect=slow_lookup)
+        lookup = CaseLookup(jac, store, 'out')
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(lookup.get('a'))) for _ in range(3)]
+        threads[0].start()
+        started.wait(5)
+        for t in threads[1:]:
+            t.start()
+        release.set()
+        for t in threads:
+            t.join(5)
+        self.assertEqual([{'case_number': 'a'}] * 3, results)
+        self.assertEqual(1, jac.lookup_case_number.call_count)
+
+    def test_pipeline(self):
+        def first(item):
+            if item['n'] == 3:
+                raise ValueError('bad item')
+            item['seen'] = ['first']
+
+        def second(item):
+            item['seen'].append('second')
+
+        done = []
+        items = [{'n': n} for n in range(10)]
+        failures = Pipeline([Stage('first', first, 3), Stage('second', second, 2)], queue_size=2).run(items,
+                                                                                                    done.append)
+        self.assertEqual(9, len(done))
+        self.assertTrue(all(x['seen'] == ['first', 'second'] for x in done))
+        self.assertEqual(1, len(failures))
+        self.assertEqual(({'n': 3}, 'first'), failures[0][:2])
+        self.assertNotIn('seen', items[3])
+
+    def test_pipeline_on_done_raising_does_not_hang(self):
+        def on_done(item):
+            if item['n'] % 2 == 0:
+                raise OSError('disk full')
+
+        items = [{'n': n} for n in range(10)]
+        failures = Pipeline([Stage('first', lambda x: None, 2), Stage('second', lambda x: None, 1)],
+                            queue_size=1).run(items, on_done)
+        self.assertEqual([(0, 'finish'), (2, 'finish'), (4, 'finish'), (6, 'finish'), (8, 'finish')],
+                         sorted((x[0]['n'], x[1]) for x in failures))
+        self.assertTrue(all(isinstance(x[2], OSError) for x in failures))
+
+    def test_pipeline_priority_runs_urgent_cases_first(self):
+        store = MagicMock()
+        store.get = MagicMock(side_effect=lambda n: {'bcpao_item': {'latest market value total': '$250,000.00'}}
+                              if n == 'c' else None)
+
+        def job(case_number, count, sale_date, comment='', bcpao_item=None):
+            r = {'case_number': case_number, 'count': count, 'foreclosure_sale_date': sale_date, 'comment': comment}
+            if bcpao_item is not None:
+                r['bcpao_item'] = bcpao_item
+            return CaseJob(r, None)
+
+        jobs = [job('a', 1, date(2017, 5, 17)),
+                job('b', 2, date(2017, 5, 10), 'CANCELLED'),
+                job('c', 3, date(2017, 5, 10)),
+                job('d', 4, date(2017, 5, 10), bcpao_item={'latest market value total': '$90,000.00'}),
+                job('e', 5, date(2017, 5, 10))]
+        order = []
+        stages = [Stage('first', lambda x: None, 1), Stage('second', lambda x: order.append(x.r['case_number']), 1)]
+        priority = CasePriority(store)
+        priority.key = MagicMock(side_effect=priority.key)
+        Pipeline(stages, queue_size=2, priority=priority.key).run(jobs)
+        self.assertEqual(['c', 'd', 'e', 'b', 'a'], order)
+        self.assertEqual(5, priority.key.call_count)
+        self.assertEqual(4, store.get.call_count)
+
+        order = []
+        Pipeline(stages, queue_size=2).run(jobs)
+        self.assertEqual(['a', 'b', 'c', 'd', 'e'], order)
+
+    def test_tax_roll_index(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'roll.csv')
+            with open(path, 'w') as f:
+                f.write('account,owner,amount_due\n2627712,"COOK, WALLACE","$1,234.50"\n2514907,KNOWLES,0.00\n25')
+            index = TaxRollIndex()
+            index.open(path)
+            self.assertEqual('$1,234.50', index.get_amount('2627712'))
+            self.assertEqual({'account': '2514907', 'owner': 'KNOWLES', 'amount_due': '0.00'}, index.get('2514907'))
+            self.assertIsNone(index.get('2500001'))
+            with open(path, 'a') as f:
+                f.write('00001,NEW,5.00\n')
+            self.assertEqual(1, index.load())
+            self.assertEqual('5.00', index.get_amount('2500001'))
+            self.assertIsNone(index.get('25'))
+            index.mm.close()
+
+    def test_taxes_from_tax_roll(self):
+        class StubRoll(object):
+            pass
+
+        roll = StubRoll()
+        roll.is_open = MagicMock(return_value=True)
+        roll.age = MagicMock(return_value=10)
+        roll.get_amount = MagicMock(side_effect=['$1,234.50', None])
+
+        class StubTaxesInfra(object):
+            pass
+
+        taxes_infra = StubTaxesInfra()
+        with open('test_resources/taxes_resp.html', 'rb') as myfile:
+            taxes_infra.get_resp_from_req = MagicMock(return_value=myfile.read())
+        taxes = Taxes(taxes_infra, roll, 60)
+        self.assertEqual('1234.50', taxes.get_info_from_account('2627712')['value_to_use'])
+        taxes_infra.get_resp_from_req.assert_not_called()
+        self.assertEqual('859.99', taxes.get_info_from_account('2514907')['value_to_use'])
+        roll.age = MagicMock(return_value=61)
+        self.assertIsNone(taxes.get_info_from_tax_roll('2627712'))
+
+    def test_rewrite_url_for_upstream(self):
+        self.assertEqual('http://127.0.0.1:8013/www.bcpao.us/api/v1/search?lot=3',
+                         rewrite_url('https://www.bcpao.us/api/v1/search?lot=3', 'http://127.0.0.1:8013/'))
+        self.assertEqual('http://127.0.0.1:8013/web1.brevardclerk.us/oncoreweb/search.aspx',
+                         rewrite_url('http://127.0.0.1:8013/web1.brevardclerk.us/oncoreweb/search.aspx',
+                                     'http://127.0.0.1:8013'))
+
+    def test_transport_pools_timeouts_and_preconnect(self):
+        import transport
+        from replay import ReplayHandler, ThreadingHTTPServer
+        httpd = ThreadingHTTPServer(('127.0.0.1', 0), ReplayHandler)
+        try:
+            Jac.configure_transport({'beca': 2, 'bcpao': 4, 'public_records': 6, 'schedule': 1}, 'taxes=5:30,bcpao=20')
+            s1, s2 = transport.new_session(), transport.new_session()
+            beca = s1.get_adapter('https://vmatrix1.brevardclerk.us/beca/StartSearch.cfm')
+            self.assertIs(beca, s2.get_adapter('https://vmatrix1.brevardclerk.us/beca/CaseNumber_Display.cfm'))
+            self.assertEqual(2, beca._pool_maxsize)
+            self.assertEqual(4, s1.get_adapter('https://www.bcpao.us/api/v1/search')._pool_maxsize)
+            self.assertEqual(transport.DEFAULT_POOL_SIZE, s1.get_adapter('https://www.bcpao.us.evil/')._pool_maxsize)
+            # schedule and oncoreweb are plain http
+            self.assertEqual(6, s1.get_adapter('http://web1.brevardclerk.us/oncoreweb/search.aspx')._pool_maxsize)
+            self.assertEqual(1, s1.get_adapter('http://vweb2.brevardclerk.us/Foreclosures/foreclosure_sales.html')
+                             ._pool_maxsize)
+            self.assertEqual(['http://vweb2.brevardclerk.us/', 'https://vmatrix1.brevardclerk.us/',
+                              'http://web1.brevardclerk.us/', 'https://www.bcpao.us/',
+                              'https://brevard.county-taxes.com/'], transport.get_preconnect_urls())
+            self.assertEqual('gzip, deflate', s1.headers['Accept-Encoding'])
+            config = transport.get_config()
+            self.assertEqual((5, 30), config.get_timeout('https://brevard.county-taxes.com/public/real_estate/'))
+            self.assertEqual((10, 20), config.get_timeout('https://www.bcpao.us/api/v1/account/1'))
+            self.assertEqual((10, 100), config.get_timeout('https://vmatrix1.brevardclerk.us/beca/'))
+            self.assertEqual(transport.DEFAULT_TIMEOUT, config.get_timeout('https://example.com/'))
+            s1.close()  # sessions do not close the shared pools
+
+            url = 'http://127.0.0.1:%d/' % httpd.server_address[1]
+            self.assertEqual(1, transport.preconnect([url]))
+            pool = s2.get_adapter(url).poolmanager.connection_from_url(url)
+            self.assertEqual(1, pool.num_connections)
+            self.assertEqual(0, transport.preconnect(['http://127.0.0.1:1/']))
+            jac = Jac()
+            jac.set_stage_workers({'beca': 2, 'taxes': 4})
+            self.assertEqual({'bcpao': 1, 'beca': 2, 'public_records': 5, 'schedule': 1, 'taxes': 4},
+                             jac.get_pool_sizes(4))
+
+            # a later configuration takes effect for new sessions, and close_all() goes back to the defaults
+            Jac.configure_transport({'beca': 3})
+            self.assertEqual(3, transport.new_session().get_adapter('https://vmatrix1.brevardclerk.us/')._pool_maxsize)
+            self.assertEqual(transport.DEFAULT_TIMEOUT,
+                             transport.get_config().get_timeout('https://www.bcpao.us/api/v1/account/1'))
+            transport.close_all()
+            self.assertEqual(transport.DEFAULT_POOL_SIZE,
+                             transport.new_session().get_adapter('https://vmatrix1.brevardclerk.us/')._pool_maxsize)
+
+            # a stand-in upstream only applies to the configuration it was given to
+            Jac.configure_transport({'beca': 2}, upstream=url)
+            self.assertEqual(url, transport.new_session().get_adapter('https://www.bcpao.us/').upstream)
+            self.assertEqual([url], transport.get_preconnect_urls())
+            Jac.configure_transport({'beca': 2})
+            self.assertFalse(hasattr(transport.new_session().get_adapter('https://www.bcpao.us/'), 'upstream'))
+        finally:
+            httpd.server_close()
+            transport.close_all()
+
+    def test_replay_routes_and_latency(self):
+        names = [r.name for r in get_routes() if r.matches('www.bcpao.us', '/api/v1/account/2627712')]
+        self.assertEqual(['bcpao_account'], names)
+        self.assertEqual(0.25, Latency('fixed:0.25').sample())
+        self.assertTrue(0.1 <= Latency('uniform:0.1:0.2').sample() <= 0.2)
+        self.assertRaises(ValueError, Latency, 'normal:1')
+
+    def test_capture_archive_replays_without_network(self):
+        import io
+        import infra
+        import transport
+        from datetime import timedelta
+        import requests
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'capture.zip')
+            archive = CaptureArchive(path)
+            for body, form in [(b'first', 'CaseNumber4=000001'), (b'second', 'CaseNumber4=000002')]:
+                resp = requests.models.Response()
+                resp.status_code = 200
+                resp.reason = 'OK'
+                resp.headers['Content-Type'] = 'text/html'
+                resp.raw = io.BytesIO(body)
+                resp.elapsed = timedelta(seconds=0.25)
+                resp.request = requests.Request('POST', 'https://vmatrix1.brevardclerk.us/beca/CaseNumber_Display.cfm',
+                                                data=form).prepare()
+                archive.record(resp)
+            # readable before close(), as after a process that is killed mid-capture
+            unclosed = ArchiveReplay(path)
+            self.assertEqual([1, 2], sorted(e['n'] for e in unclosed.get_entries()))
+            self.assertEqual((b'first', 200), (unclosed.read('bodies/000001'), unclosed.get_entries()[0]['status']))
+            archive.close()
+            self.assertEqual(['capture.zip'], os.listdir(tmp_dir))
+
+            replay = ArchiveReplay(path)
+            self.assertEqual([0.25, 0.25], [e['elapsed'] for e in replay.get_entries()])
+            s = requests.session()
+            s.mount('https://', replay.get_adapter())
+            try:
+                Jac.configure_transport({}, replay=path)
+                self.assertEqual(b'first', infra.new_session().post(
+                    'https://vmatrix1.brevardclerk.us/beca/CaseNumber_Display.cfm', {'CaseNumber4': '000001'}).content)
+            finally:
+                transport.close_all()
+            self.assertIsNone(infra.get_replay_archive())
+            url = 'https://vmatrix1.brevardclerk.us/beca/CaseNumber_Display.cfm'
+            self.assertEqual('second', s.post(url, {'CaseNumber4': '000002'}).text)
+            self.assertEqual(b'first', b''.join(s.post(url, {'CaseNumber4': '000001'}, stream=True).iter_content(2)))
+            self.assertRaises(requests.exceptions.ConnectionError, s.get, 'https://www.bcpao.us/api/v1/account/1')
+            replay.close()
+
+    def test_bench_generate_schedule(self):
+        rows = Foreclosures().get_rows_from_response(generate_schedule(5, [date(2017, 5, 10), date(2017, 5, 17)]))
+        self.assertEqual(5, len(rows))
+        self.assertEqual('05-2008-CA-000001-XXXX-XX', rows[0]['case_number'])
+        self.assertEqual([date(2017, 5, 10)] * 3 + [date(2017, 5, 17)] * 2, [x['foreclosure_sale_date'] for x in rows])
+        self.assertEqual(3, percentile([5, 1, 3, 2, 4], 50))
+
+    def test_memory_profiler(self):
+        disabled = MemoryProfiler()
+        func = MagicMock()
+        self.assertIs(func, disabled.wrap('beca', func))
+        with disabled.stage('schedule'):
+            pass
+        self.assertEqual({}, disabled.stages)
+
+        profiler = MemoryProfiler(True, top=3)
+        profiler.start()
+        try:
+            with self.assertLogs(level='INFO') as logs:
+                with profiler.stage('schedule', snapshot=True):
+                    kept = [bytearray(1024) for _ in range(64)]
+                profiler.wrap('beca', lambda x: x)(1)
+                profiler.wrap('beca', lambda x: x)(2)
+                profiler.report()
+        finally:
+            import tracemalloc
+            tracemalloc.stop()
+        self.assertEqual(64, len(kept))
+        self.assertEqual(['schedule', 'beca'], list(profiler.stages))
+        self.assertEqual(2, profiler.stages['beca']['calls'])
+        self.assertGreater(profiler.stages['schedule']['delta'], 64 * 1024)
+        self.assertTrue(any('peak rss' in x for x in logs.output))
+
+    def test_schedule_index(self):
+        d1, d2, d3 = date(2017, 5, 10), date(2017, 5, 17), date(2017, 5, 24)
+        items = [{'count': 1, 'foreclosure_sale_date': d1, 'comment': '', 'case_number': '05-2008-CA-000001-XXXX-XX'},
+                 {'count': 2, 'foreclosure_sale_date': d2, 'comment': 'CANCELLED',
+                  'case_number': '05-2008-CA-000002-XXXX-XX'},
+                 {'count': 3, 'foreclosure_sale_date': d1, 'comment': '', 'case_number': '05-2008-CC-000003-XXXX-XX'},
+                 {'count': 4, 'foreclosure_sale_date': d2, 'comment': '', 'case_number': '05-2008-CA-000004-XXXX-XX'},
+                 {'count': 5, 'foreclosure_sale_date': d3, 'comment': '', 'case_number': '05-2008-CA-000005-XXXX-XX'}]
+        index = ScheduleIndex(items)
+        counts = lambda rows: [x['count'] for x in rows]
+        self.assertEqual([1, 2, 3, 4, 5], counts(index.query()))
+        self.assertEqual([1, 3], counts(index.query(OnDates([d1]))))
+        self.assertEqual([2, 4], counts(index.query(DateRange(d2, d2))))
+        self.assertEqual([2, 4, 5], counts(index.query(DateRange(start=d2))))
+        self.assertEqual([1, 3, 4, 5], counts(index.query(WithStatus(ScheduleIndex.ACTIVE))))
+        self.assertEqual([3], counts(index.query(CaseType('CC'))))
+        self.assertEqual([2, 3, 4], counts(index.query(CountWindow(2, 4))))
+        self.assertEqual([4], counts(index.query(CountWindow(low=2), WithStatus(ScheduleIndex.ACTIVE), CaseType('CA'),
+                                                 DateRange(end=d2))))
+        self.assertEqual({d1: 2, d2: 1, d3: 1}, index.count_by_date(WithStatus(ScheduleIndex.ACTIVE)))
+        self.assertEqual([1, 5], counts(index.filter(lambda x: x['count'] % 4 == 1).query()))
+
 
 if __name__ == '__main__':
     unittest.main()
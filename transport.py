@@ -0,0 +1,231 @@
+import logging
+import threading
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# the upstream (scheme, host) each source talks to
+HOSTS = OrderedDict([('schedule', ('http', 'vweb2.brevardclerk.us')),
+                     ('beca', ('https', 'vmatrix1.brevardclerk.us')),
+                     ('public_records', ('http', 'web1.brevardclerk.us')),
+                     ('bcpao', ('https', 'www.bcpao.us')),
+                     ('taxes', ('https', 'brevard.county-taxes.com'))])
+DEFAULT_POOL_SIZE = 10
+# (connect, read) seconds, used whenever a request does not pass its own timeout
+DEFAULT_TIMEOUT = (10, 10)
+DEFAULT_TIMEOUTS = {'schedule': (10, 60), 'beca': (10, 100), 'public_records': (10, 60)}
+ACCEPT_ENCODING = 'gzip, deflate'
+
+
+def get_upstream():
+    return get_config().upstream
+
+
+def get_base_url(source):
+    scheme, host = HOSTS[source]
+    return scheme + '://' + host + '/'
+
+
+def rewrite_url(url, upstream):
+    # https://www.bcpao.us/api/v1/search?x=1 -> <upstream>/www.bcpao.us/api/v1/search?x=1
+    if url.startswith(upstream):
+        return url
+    scheme_sep = url.find('://')
+    return upstream.rstrip('/') + '/' + url[scheme_sep + 3:]
+
+
+def parse_per_source(arg, convert):
+    # 'beca=2,taxes=4' -> {'beca': convert('2'), 'taxes': convert('4')}
+    ret = {}
+    if arg:
+        for part in arg.split(','):
+            name, value = part.split('=')
+            ret[name.strip()] = convert(value.strip())
+    return ret
+
+
+def parse_timeout(value):
+    # '100' -> (DEFAULT_TIMEOUT[0], 100.0); '5:100' -> (5.0, 100.0)
+    connect, sep, read = value.partition(':')
+    if not sep:
+        return DEFAULT_TIMEOUT[0], float(value)
+    return float(connect), float(read)
+
+
+class TransportConfig(object):
+    """Pool sizes, timeouts and preconnect, plus the stand-in upstream or archives; see configure()."""
+
+    def __init__(self, pool_sizes=None, timeouts=None, preconnect=False, upstream=None, capture=None, replay=None):
+        self.pool_sizes = pool_sizes or {}
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        self.timeouts.update(timeouts or {})
+        self.preconnect = preconnect
+        self.upstream = upstream
+        self.capture = capture
+        self.replay = replay
+        self.sources_by_host = dict((host, source) for source, (scheme, host) in HOSTS.items())
+
+    def get_pool_size(self, source):
+        return max(1, self.pool_sizes.get(source, DEFAULT_POOL_SIZE))
+
+    def get_upstream_pool_size(self):
+        # every source shares the one stand-in host
+        return sum(self.get_pool_size(x) for x in HOSTS)
+
+    def get_timeout(self, url):
+        source = self.sources_by_host.get(urllib.parse.urlsplit(url).hostname)
+        return self.timeouts.get(source, DEFAULT_TIMEOUT)
+
+
+_config = None
+_adapters = None
+_adapters_lock = threading.Lock()
+
+
+def get_config():
+    global _config
+    if _config is None:
+        _config = TransportConfig()
+    return _config
+
+
+def configure(config):
+    """Replaces the configuration and closes the current pools; sessions created from now on use the new pools."""
+    global _config
+    close_all()
+    with _adapters_lock:
+        _config = config
+
+
+def get_pooled_adapter_class():
+    from requests.adapters import HTTPAdapter
+
+    class PooledAdapter(HTTPAdapter):
+        """A connection pool shared by every session; fills in the configured timeout for the request's host."""
+
+        def send(self, request, **kwargs):
+            if kwargs.get('timeout') is None:
+                kwargs['timeout'] = get_config().get_timeout(request.url)
+            return HTTPAdapter.send(self, request, **kwargs)
+
+        def close(self):
+            # sessions come and go (robobrowser makes one per search); the pools outlive them, see close_all()
+            pass
+
+        def close_pools(self):
+            HTTPAdapter.close(self)
+
+    return PooledAdapter
+
+
+def get_upstream_adapter_class():
+    pooled_adapter_class = get_pooled_adapter_class()
+
+    class UpstreamAdapter(pooled_adapter_class):
+        """Sends each request to the stand-in upstream."""
+
+        def __init__(self, upstream, **kwargs):
+            pooled_adapter_class.__init__(self, **kwargs)
+            self.upstream = upstream
+
+        def send(self, request, **kwargs):
+            if kwargs.get('timeout') is None:
+                kwargs['timeout'] = get_config().get_timeout(request.url)
+            rewritten = request.copy()
+            rewritten.url = rewrite_url(request.url, self.upstream)
+            resp = pooled_adapter_class.send(self, rewritten, **kwargs)
+            # callers (robobrowser resolving form actions, capture) see the original url
+            resp.url = request.url
+            resp.request = request
+            return resp
+
+    return UpstreamAdapter
+
+
+def get_adapters():
+    """url prefix -> adapter, created once per process so every session shares the same per-host pools."""
+    global _adapters
+    if _adapters is None:
+        with _adapters_lock:
+            if _adapters is None:
+                config = get_config()
+                upstream = get_upstream()
+                adapters = OrderedDict()
+                if upstream:
+                    size = config.get_upstream_pool_size()
+                    adapter = get_upstream_adapter_class()(upstream, pool_connections=1, pool_maxsize=size)
+                    adapters['http://'] = adapter
+                    adapters['https://'] = adapter
+                else:
+                    pooled_adapter_class = get_pooled_adapter_class()
+                    adapters['http://'] = pooled_adapter_class()
+                    adapters['https://'] = pooled_adapter_class()
+                    for source in HOSTS:
+                        size = config.get_pool_size(source)
+                        adapters[get_base_url(source)] = pooled_adapter_class(pool_connections=1, pool_maxsize=size)
+                _adapters = adapters
+                if config.preconnect:
+                    start_preconnect()
+    return _adapters
+
+
+def new_session():
+    import requests
+    s = requests.session()
+    s.headers['Accept-Encoding'] = ACCEPT_ENCODING
+    for prefix, adapter in get_adapters().items():
+        s.mount(prefix, adapter)
+    return s
+
+
+def get_preconnect_urls():
+    upstream = get_upstream()
+    if upstream:
+        return [upstream]
+    return [get_base_url(x) for x in HOSTS]
+
+
+def connect(url):
+    """Opens (dns, tcp and tls) one idle connection to url's host in its shared pool."""
+    pool = new_session().get_adapter(url).poolmanager.connection_from_url(url)
+    conn = pool._get_conn()
+    try:
+        conn.timeout = get_config().get_timeout(url)[0]
+        conn.connect()
+    finally:
+        pool._put_conn(conn)
+
+
+def preconnect(urls=None, wait=True):
+    """Connects to every upstream host in parallel; returns how many connected (None if not waiting)."""
+    urls = urls if urls is not None else get_preconnect_urls()
+
+    def connect_one(url):
+        try:
+            connect(url)
+            logging.debug('preconnected %s', url)
+            return True
+        except Exception:
+            logging.warning('could not preconnect %s', url, exc_info=True)
+            return False
+
+    executor = ThreadPoolExecutor(max_workers=max(1, len(urls)))
+    futures = [executor.submit(connect_one, x) for x in urls]
+    executor.shutdown(wait=wait)
+    if not wait:
+        return None
+    return sum(1 for x in futures if x.result())
+
+
+def start_preconnect():
+    preconnect(wait=False)
+
+
+def close_all():
+    """Closes the shared pools and goes back to the default configuration."""
+    global _config, _adapters
+    with _adapters_lock:
+        for adapter in set((_adapters or {}).values()):
+            adapter.close_pools()
+        _adapters = None
+        _config = None